@@ -0,0 +1,281 @@
+"""
+End-to-end harvest benchmark: runs gather_stage, fetch_stage and
+import_stage of a harvester against the local stand-in OAI-PMH server
+(benchmarks.oai_server) and reports records/sec and p50/p99 latency per
+stage.
+
+Needs a CKAN instance with ckanext-harvest and this extension, like the
+one of the test suite; the harvest source, its datasets and jobs are
+removed again unless --keep is given.
+
+    python -m benchmarks.harvest -c test.ini --harvester nmrxiv --records 10000 \\
+        --config '{"list_records": true}' --save nmrxiv.json
+    python -m benchmarks.harvest -c test.ini --harvester nmrxiv --records 10000 \\
+        --config '{"list_records": true}' --baseline nmrxiv.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import math
+import time
+
+from benchmarks.oai_server import METADATA_PREFIX
+from benchmarks.oai_server import add_arguments
+from benchmarks.oai_server import repository_from_args
+from benchmarks.oai_server import serve
+
+HARVESTERS = {
+    "massbank": "ckanext.massbankharvester.harvester.massbankharvester",
+    "nmrxiv": "ckanext.massbankharvester.harvester.nmrXivharvester",
+}
+ORGANIZATION = "harvest-benchmark"
+
+
+def percentile(samples, q):
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, int(math.ceil(q / 100.0 * len(ordered))) - 1)]
+
+
+class StageTimer(object):
+    """
+    Latencies of one harvest stage, in seconds
+    """
+
+    def __init__(self, name, unit="record"):
+        self.name = name
+        self.unit = unit
+        self.samples = []
+        self.records = 0
+
+    def time(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.samples.append(time.perf_counter() - start)
+
+    def summary(self, seconds=None):
+        """
+        :param seconds: wall time of the stage, if it is more than the
+            sum of the samples
+        """
+        total = seconds or sum(self.samples)
+        return {
+            "unit": self.unit,
+            "records": self.records,
+            "seconds": total,
+            "records_per_second": self.records / total if total else 0.0,
+            "p50_ms": percentile(self.samples, 50) * 1000,
+            "p99_ms": percentile(self.samples, 99) * 1000,
+        }
+
+
+def timed_pages(pages, timer):
+    """
+    Time every page of a list_pages() generator, from its request until
+    the gather loop has handled its last item
+    """
+    start = time.perf_counter()
+    for page in pages:
+        yield page
+        timer.samples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+
+
+def create_source(url, harvester_config, context):
+    from ckan.logic import get_action
+
+    try:
+        get_action("organization_show")(context.copy(), {"id": ORGANIZATION})
+    except Exception:
+        get_action("organization_create")(context.copy(), {"name": ORGANIZATION})
+    return get_action("harvest_source_create")(context.copy(), {
+        "name": "benchmark-%d" % time.time(),
+        "title": "Harvest benchmark",
+        "url": url,
+        "source_type": "OAI JSON-LD Harvester",
+        "owner_org": ORGANIZATION,
+        "config": json.dumps(harvester_config),
+    })
+
+
+def remove_source(source_id, context):
+    from ckan.logic import get_action
+
+    get_action("harvest_source_clear")(context.copy(), {"id": source_id})
+    get_action("dataset_purge")(context.copy(), {"id": source_id})
+
+
+def run_stages(harvester, job):
+    """
+    Run the stages one object after the other, with the bookkeeping of the
+    ckanext-harvest fetch consumer
+    """
+    from ckanext.harvest.model import HarvestObject
+    from ckanext.massbankharvester.indexing import index_queued
+
+    gather = StageTimer("gather", unit="page")
+    fetch = StageTimer("fetch")
+    import_ = StageTimer("import")
+
+    identifier_generator = harvester._identifier_generator
+    record_generator = harvester._record_generator
+    harvester._identifier_generator = lambda *args: timed_pages(identifier_generator(*args), gather)
+    harvester._record_generator = lambda *args: timed_pages(record_generator(*args), gather)
+
+    start = time.perf_counter()
+    job.gather_started = datetime.datetime.utcnow()
+    object_ids = harvester.gather_stage(job) or []
+    job.gather_finished = datetime.datetime.utcnow()
+    job.status = "Running"
+    job.save()
+    gather.records = len(object_ids)
+    gather_seconds = time.perf_counter() - start
+
+    for object_id in object_ids:
+        obj = HarvestObject.get(object_id)
+        obj.fetch_started = datetime.datetime.utcnow()
+        obj.state = "FETCH"
+        obj.save()
+        fetched = fetch.time(harvester.fetch_stage, obj)
+        obj.fetch_finished = datetime.datetime.utcnow()
+        if fetched is not True:
+            obj.state = "ERROR"
+            obj.save()
+            continue
+        fetch.records += 1
+        obj.import_started = datetime.datetime.utcnow()
+        obj.state = "IMPORT"
+        obj.save()
+        imported = import_.time(harvester.import_stage, obj)
+        obj.import_finished = datetime.datetime.utcnow()
+        obj.state = "COMPLETE" if imported else "ERROR"
+        if imported == "unchanged":
+            obj.report_status = "not modified"
+        obj.save()
+        if imported:
+            import_.records += 1
+
+    # packages still waiting in the index queue belong to import
+    flush_start = time.perf_counter()
+    index_queued(job.id)
+    flush_seconds = time.perf_counter() - flush_start
+
+    job.status = "Finished"
+    job.finished = datetime.datetime.utcnow()
+    job.save()
+
+    results = {
+        # the page times leave out Identify and the object inserts
+        "gather": gather.summary(gather_seconds),
+        "fetch": fetch.summary(),
+        "import": import_.summary(sum(import_.samples) + flush_seconds),
+    }
+    total = time.perf_counter() - start
+    results["total"] = {
+        "unit": "job",
+        "records": import_.records,
+        "seconds": total,
+        "records_per_second": import_.records / total,
+    }
+    return results
+
+
+def report(results, baseline=None):
+    print("%-8s %8s %10s %10s %10s %10s" % (
+        "stage", "records", "seconds", "records/s", "p50 ms", "p99 ms"))
+    for name, stage in results["stages"].items():
+        line = "%-8s %8d %10.2f %10.1f" % (
+            name, stage["records"], stage["seconds"], stage["records_per_second"])
+        if "p50_ms" in stage:
+            line += " %10.2f %10.2f" % (stage["p50_ms"], stage["p99_ms"])
+            if stage["unit"] != "record":
+                line += "  (per %s)" % stage["unit"]
+        if baseline and name in baseline["stages"]:
+            before = baseline["stages"][name]["records_per_second"]
+            if before:
+                line += "  %+.1f%% records/s" % (
+                    (stage["records_per_second"] / before - 1) * 100)
+        print(line)
+
+
+def run(args):
+    from ckan import model
+    from ckan.logic import get_action
+    from ckanext.harvest.model import HarvestJob
+    from ckanext.harvest.model import HarvestSource
+
+    repository = repository_from_args(args)
+    server = serve(repository, latency=args.latency / 1000.0)
+    url = "http://%s:%s/oai" % server.server_address
+
+    harvester_config = {
+        "metadata_prefix": METADATA_PREFIX,
+        "from": repository.datestamp(0),
+        "until": repository.until_datestamp(),
+    }
+    harvester_config.update(json.loads(args.config))
+    user = get_action("get_site_user")({"model": model, "ignore_auth": True}, {})
+    context = {"model": model, "session": model.Session, "user": user["name"]}
+
+    source = create_source(url, harvester_config, context)
+    try:
+        job = HarvestJob(source=HarvestSource.get(source["id"]))
+        job.save()
+        harvester = importlib.import_module(HARVESTERS[args.harvester]).MassbankHarvester()
+        stages = run_stages(harvester, job)
+    finally:
+        server.shutdown()
+        if not args.keep:
+            remove_source(source["id"], context)
+
+    return {
+        "harvester": args.harvester,
+        "records": args.records,
+        "page_size": args.page_size,
+        "latency_ms": args.latency,
+        "config": harvester_config,
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-c", "--ckan-ini", required=True)
+    parser.add_argument("--harvester", choices=sorted(HARVESTERS), default="massbank")
+    add_arguments(parser)
+    parser.set_defaults(source=None)
+    parser.add_argument("--config", default="{}",
+                        help="harvest source config (JSON) on top of the defaults")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the harvest source and its datasets")
+    args = parser.parse_args()
+    args.source = args.source or args.harvester
+
+    from ckan.cli import load_config
+    from ckan.config.middleware import make_app
+
+    app = make_app(load_config(args.ckan_ini))
+    with app.apps["flask_app"]._wsgi_app.test_request_context():
+        results = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
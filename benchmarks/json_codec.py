@@ -0,0 +1,68 @@
+"""
+Per-record cost of turning a jc:json container into HarvestObject content
+(fetch stage) and parsing it again (import stage), before and after the
+jsoncodec module, for every installed JSON backend.
+
+    python -m benchmarks.json_codec [--records 2000]
+"""
+import argparse
+import importlib
+import json
+import re
+import timeit
+
+from benchmarks.records import container_text
+from benchmarks.records import massbank_record
+from benchmarks.records import nmrxiv_record
+from ckanext.massbankharvester import jsoncodec
+
+
+def previous(json_data):
+    # fetch_stage: join, collapse whitespace, parse, serialize again
+    data = re.sub(r'[\n ]+', ' ', ''.join(json_data)).strip()
+    content = json.dumps(json.loads(data))
+    # import_stage
+    return json.loads(content)
+
+
+def current(json_data):
+    content, _ = jsoncodec.normalize_container(json_data)
+    return jsoncodec.loads(content)
+
+
+def backends():
+    yield "json", json.loads
+    for name in ("ujson", "orjson"):
+        try:
+            yield name, importlib.import_module(name).loads
+        except ImportError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+
+    for source, make_record in (("massbank", massbank_record), ("nmrxiv", nmrxiv_record)):
+        containers = [[container_text(make_record(i))] for i in range(args.records)]
+        size = sum(len(c[0]) for c in containers) / len(containers)
+        assert all(previous(c) == current(c) for c in containers[:10])
+
+        def per_record(func):
+            seconds = min(timeit.repeat(
+                lambda: [func(c) for c in containers], number=1, repeat=5
+            ))
+            return seconds / len(containers) * 1e6
+
+        before = per_record(previous)
+        print("%s (%.1f KB per record)" % (source, size / 1024))
+        print("  %-24s %8.1f us/record" % ("before", before))
+        for name, loads in backends():
+            jsoncodec._loads = loads
+            after = per_record(current)
+            print("  %-24s %8.1f us/record  (%.2fx)" % ("jsoncodec, " + name, after, before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Local stand-in OAI-PMH endpoint serving synthetic MassBank-style (flat) or
+nmrXiv-style ([dataset, study]) JSON containers, generated on the fly so
+that any number of records costs no memory.
+
+Supports Identify, ListSets, ListIdentifiers, ListRecords and GetRecord
+with from/until/set selection and resumption tokens. Record i has the
+datestamp 2023-01-01T00:00:00Z + i minutes and belongs to set i % sets.
+
+    python -m benchmarks.oai_server --source nmrxiv --records 100000 --port 8765
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+from benchmarks.records import container_text
+from benchmarks.records import massbank_record
+from benchmarks.records import nmrxiv_record
+
+BASE_DATESTAMP = datetime(2023, 1, 1)
+STEP = timedelta(minutes=1)
+DATESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+METADATA_PREFIX = "json_container"
+RECORD_FACTORIES = {"massbank": massbank_record, "nmrxiv": nmrxiv_record}
+
+_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+    "<responseDate>%s</responseDate><request>%s</request>%s</OAI-PMH>"
+)
+
+
+class OAIRepository(object):
+    """
+    The records of the stand-in endpoint, selected and paged like an
+    OAI-PMH repository would
+    """
+
+    def __init__(self, source="massbank", records=1000, page_size=100, sets=1):
+        self.source = source
+        self.records = records
+        self.page_size = page_size
+        self.sets = sets
+        self.make_record = RECORD_FACTORIES[source]
+
+    def identifier(self, i):
+        return "bench-%s-%08d" % (self.source, i)
+
+    def datestamp(self, i):
+        return (BASE_DATESTAMP + i * STEP).strftime(DATESTAMP_FORMAT)
+
+    def set_spec(self, i):
+        return "%s-%d" % (self.source, i % self.sets)
+
+    def until_datestamp(self):
+        """
+        A datestamp after the last record
+        """
+        return (BASE_DATESTAMP + self.records * STEP).strftime(DATESTAMP_FORMAT)
+
+    def header(self, i):
+        return (
+            "<header><identifier>%s</identifier><datestamp>%s</datestamp>"
+            "<setSpec>%s</setSpec></header>"
+            % (self.identifier(i), self.datestamp(i), self.set_spec(i))
+        )
+
+    def record(self, i):
+        return (
+            "<record>%s<metadata>"
+            '<jc:json xmlns:jc="http://denbi.de/schemas/json-container">%s</jc:json>'
+            "</metadata></record>"
+            % (self.header(i), escape(container_text(self.make_record(i))))
+        )
+
+    def select(self, args):
+        """
+        :returns: range of the record numbers matching from, until and set
+        """
+        start, stop = 0, self.records
+        if args.get("from"):
+            offset = _parse_datestamp(args["from"]) - BASE_DATESTAMP
+            start = max(start, -(-offset // STEP))
+        if args.get("until"):
+            offset = _parse_datestamp(args["until"]) - BASE_DATESTAMP
+            stop = min(stop, offset // STEP + 1)
+        if args.get("set"):
+            set_number = int(args["set"].rsplit("-", 1)[1])
+            start += (set_number - start) % self.sets
+            return range(start, max(start, stop), self.sets)
+        return range(start, max(start, stop))
+
+    def respond(self, args):
+        verb = args.get("verb")
+        try:
+            if verb == "Identify":
+                return self.identify()
+            if verb == "ListSets":
+                return self.list_sets()
+            if verb in ("ListIdentifiers", "ListRecords"):
+                return self.list(verb, args)
+            if verb == "GetRecord":
+                return self.get_record(args)
+            raise OAIError("badVerb", "Illegal verb %s" % verb)
+        except OAIError as e:
+            return '<error code="%s">%s</error>' % (e.code, escape(e.message))
+
+    def identify(self):
+        return (
+            "<Identify><repositoryName>benchmark %s</repositoryName>"
+            "<baseURL>http://localhost/oai</baseURL>"
+            "<protocolVersion>2.0</protocolVersion>"
+            "<adminEmail>admin@localhost</adminEmail>"
+            "<earliestDatestamp>%s</earliestDatestamp>"
+            "<deletedRecord>no</deletedRecord>"
+            "<granularity>YYYY-MM-DDThh:mm:ssZ</granularity></Identify>"
+            % (self.source, self.datestamp(0))
+        )
+
+    def list_sets(self):
+        return "<ListSets>%s</ListSets>" % "".join(
+            "<set><setSpec>%s</setSpec><setName>%s</setName></set>"
+            % (self.set_spec(n), self.set_spec(n))
+            for n in range(self.sets)
+        )
+
+    def list(self, verb, args):
+        if args.get("resumptionToken"):
+            try:
+                start, stop, step, offset = map(int, args["resumptionToken"].split(":"))
+            except ValueError:
+                raise OAIError("badResumptionToken", args["resumptionToken"])
+            selected = range(start, stop, step)
+        else:
+            if args.get("metadataPrefix") != METADATA_PREFIX:
+                raise OAIError("cannotDisseminateFormat", str(args.get("metadataPrefix")))
+            selected = self.select(args)
+            offset = 0
+        page = selected[offset:offset + self.page_size]
+        if not page:
+            raise OAIError("noRecordsMatch", "No records match")
+        item = self.header if verb == "ListIdentifiers" else self.record
+        items = "".join(item(i) for i in page)
+        token = ""
+        if offset + self.page_size < len(selected):
+            token = "<resumptionToken>%d:%d:%d:%d</resumptionToken>" % (
+                selected.start, selected.stop, selected.step, offset + self.page_size
+            )
+        return "<%s>%s%s</%s>" % (verb, items, token, verb)
+
+    def get_record(self, args):
+        identifier = args.get("identifier", "")
+        try:
+            i = int(identifier.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            i = -1
+        if identifier != self.identifier(i) or not 0 <= i < self.records:
+            raise OAIError("idDoesNotExist", identifier)
+        return "<GetRecord>%s</GetRecord>" % self.record(i)
+
+
+class OAIError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+def _parse_datestamp(value):
+    if len(value) == 10:
+        return datetime.strptime(value, "%Y-%m-%d")
+    return datetime.strptime(value, DATESTAMP_FORMAT)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # answer small responses right away instead of waiting for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._reply(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._reply(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+    def _reply(self, query):
+        args = dict((key, values[0]) for key, values in query.items())
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = _RESPONSE % (
+            datetime.utcnow().strftime(DATESTAMP_FORMAT),
+            escape(self.path),
+            self.server.repository.respond(args),
+        )
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(repository, host="127.0.0.1", port=0, latency=0):
+    """
+    Serve a repository from a background thread
+
+    :param latency: seconds added to every response
+    :returns: the server, its URL is "http://%s:%s/oai" % server.server_address
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.repository = repository
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--source", choices=sorted(RECORD_FACTORIES), default="massbank")
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--sets", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every response")
+
+
+def repository_from_args(args):
+    return OAIRepository(args.source, args.records, args.page_size, args.sets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = serve(repository_from_args(args), args.host, args.port, args.latency / 1000.0)
+    print("Serving %s %s records on http://%s:%s/oai" % (
+        args.records, args.source, args.host, server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
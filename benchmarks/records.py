@@ -0,0 +1,125 @@
+"""
+Synthetic records shaped like the JSON containers served by the MassBank
+(one flat JSON-LD object) and nmrXiv (a [dataset, study] pair) OAI-PMH
+endpoints, with the fields read by the harvesters.
+"""
+import json
+import random
+
+INCHI = "InChI=1S/C6H12O6/c7-1-2-3(8)4(9)5(10)6(11)12-2/h2-11H,1H2/t2-,3-,4+,5-,6?/m1/s1"
+SMILES = "OC[C@H]1OC(O)[C@H](O)[C@@H](O)[C@@H]1O"
+
+
+def _inchi_key(i):
+    rnd = random.Random(i)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return "%s-%s-N" % (
+        "".join(rnd.choice(letters) for _ in range(14)),
+        "".join(rnd.choice(letters) for _ in range(10)),
+    )
+
+
+def _peaks(i, count):
+    rnd = random.Random(i)
+    return [
+        "%.4f %d %d" % (rnd.uniform(50, 500), rnd.randint(1, 100000), rnd.randint(1, 999))
+        for _ in range(count)
+    ]
+
+
+def massbank_record(i, peaks=40):
+    identifier = "MSBNK-Bench-%08d" % i
+    return {
+        "@context": "https://schema.org",
+        "@type": "Dataset",
+        "@id": "https://massbank.eu/MassBank/RecordDisplay?id=%s" % identifier,
+        "identifier": identifier,
+        "name": "Glucose; LC-ESI-QTOF; MS2; CE: 20 eV; R=35000; [M-H]- %d" % i,
+        "headline": "Glucose; LC-ESI-QTOF; MS2; [M-H]-",
+        "description": (
+            "This MassBank record with Accession %s contains the MS2 mass "
+            "spectrum of 'Glucose'.\nIt was acquired on a LC-ESI-QTOF, "
+            "with the ionization mode NEGATIVE.\n" % identifier
+        ),
+        "url": "https://massbank.eu/MassBank/RecordDisplay?id=%s" % identifier,
+        "format": ["text/plain"],
+        "license": "https://creativecommons.org/licenses/by/4.0/",
+        "creator": ["Doe J", "Roe R", "Bench B"],
+        "rights": ["CC BY 4.0"],
+        "measurementTechnique": "liquid chromatography-mass spectrometry",
+        "keywords": ["MS2", "LC-ESI-QTOF", "NEGATIVE"],
+        "datePublished": "2016-01-19",
+        "dateCreated": "2016-01-19",
+        "dateModified": "2023-02-01",
+        "alternateName": ["Glucose", "D-Glucose", "Dextrose"],
+        "inChI": INCHI,
+        "inchikey": _inchi_key(i),
+        "smiles": SMILES,
+        "molecularFormula": "C6H12O6",
+        "monoisotopicMolecularWeight": 180.06339,
+        "peaks": _peaks(i, peaks),
+    }
+
+
+def nmrxiv_record(i, parts=3):
+    identifier = "NMRXIV:D%07d" % i
+    molecules = [
+        {
+            "@type": "MolecularEntity",
+            "name": "Molecule %d-%d" % (i, n),
+            "description": "Isolated compound %d of study %d" % (n, i),
+            "inChI": INCHI,
+            "inChIKey": _inchi_key(i * 10 + n),
+            "smiles": [SMILES, SMILES, SMILES],
+            "molecularFormula": "C6H12O6",
+            "molecularWeight": 180.156,
+            "url": "https://nmrxiv.org/compound/%d-%d" % (i, n),
+        }
+        for n in range(parts)
+    ]
+    study = {
+        "@context": "https://schema.org",
+        "@type": "Study",
+        "@id": "https://nmrxiv.org/S%d" % i,
+        "name": "NMR study %d of natural products" % i,
+        "description": "1D and 2D NMR spectra of compounds isolated in study %d." % i,
+        "url": "https://nmrxiv.org/S%d" % i,
+        "publisher": "nmrXiv",
+        "datePublished": "2023-03-01T10:00:00+00:00",
+        "dateCreated": "2023-02-01T10:00:00+00:00",
+        "dateModified": "2023-03-02T10:00:00+00:00",
+        "measurementTechnique": "nuclear magnetic resonance spectroscopy",
+        "isPartOf": {
+            "@type": "Project",
+            "name": "Project %d" % i,
+            "citation": {"author": ["Doe J", "Roe R", "Bench B"]},
+        },
+        "about": {
+            "@type": "ChemicalSubstance",
+            "name": "Sample %d" % i,
+            "url": "https://nmrxiv.org/S%d/sample" % i,
+            "format": ["nmredata"],
+            "hasBioChemEntityPart": molecules,
+        },
+    }
+    dataset = {
+        "@context": "https://schema.org",
+        "@type": "Dataset",
+        "@id": identifier,
+        "name": "Dataset %d" % i,
+        "url": "https://nmrxiv.org/D%d" % i,
+        "measurementTechnique": "1H NMR",
+        "variableMeasured": [
+            {"@type": "PropertyValue", "name": "frequency", "value": 600},
+            {"@type": "PropertyValue", "name": "solvent", "value": "CDCl3"},
+        ],
+    }
+    return [dataset, study]
+
+
+def container_text(record):
+    """
+    The record as it appears inside of jc:json: pretty-printed, with a raw
+    line break inside of the description
+    """
+    return json.dumps(record, indent=2).replace("\\n", "\n")
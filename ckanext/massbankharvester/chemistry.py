@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.images import image_path
+from ckanext.massbankharvester.model import ImageQueueItem
+
+log = logging.getLogger(__name__)
+
+_molecule_cache = None
+
+# seconds to wait for the SQLite lock of another worker
+SQLITE_TIMEOUT = 5
+
+
+def compute_molecule(inchi_key, standard_inchi):
+    """
+    Values derived from the InChI of a molecule with RDKit
+
+    :returns: dict with mol_weight, exact_mass, formula and image_path,
+        None if RDKit can't parse the InChI
+    """
+    from rdkit.Chem import Descriptors
+    from rdkit.Chem import inchi
+    from rdkit.Chem import rdMolDescriptors
+
+    molecule = inchi.MolFromInchi(standard_inchi)
+    if molecule is None:
+        log.warning("Invalid InChI for %s: %s" % (inchi_key, standard_inchi))
+        return None
+    return {
+        "mol_weight": Descriptors.MolWt(molecule),
+        "exact_mass": Descriptors.ExactMolWt(molecule),
+        "formula": rdMolDescriptors.CalcMolFormula(molecule),
+        "image_path": image_path(inchi_key),
+    }
+
+
+class MoleculeCache(object):
+    """
+    InChIKey -> compute_molecule() values, shared by all records and jobs.
+
+    A bounded in-memory LRU sits in front of a SQLite file, so a compound
+    is parsed by RDKit once per installation, and looked up from disk once
+    per process. The file is shared by the workers of a host and is only
+    best-effort: when it fails, e.g. while another worker holds its lock for
+    longer than SQLITE_TIMEOUT, the values are computed again or kept in
+    memory.
+    """
+
+    def __init__(self, path=None, maxsize=10000):
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._db = sqlite3.connect(
+                    path, timeout=SQLITE_TIMEOUT, check_same_thread=False
+                )
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS molecule "
+                    "(inchi_key TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                )
+                self._db.commit()
+            except (OSError, sqlite3.Error) as e:
+                log.warning("Molecule cache %s not usable, keeping it in memory: %s" % (path, e))
+                self._db = None
+
+    def get(self, inchi_key):
+        values = self._memory.get(inchi_key)
+        if values is None and self._db is not None:
+            try:
+                with self._lock:
+                    row = self._db.execute(
+                        "SELECT data FROM molecule WHERE inchi_key = ?", (inchi_key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                log.warning("Reading %s from the molecule cache failed: %s" % (inchi_key, e))
+                row = None
+            if row is not None:
+                values = json.loads(row[0])
+                self._memory.set(inchi_key, values)
+        return values
+
+    def set(self, inchi_key, values):
+        self._memory.set(inchi_key, values)
+        if self._db is not None:
+            with self._lock:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO molecule (inchi_key, data) VALUES (?, ?)",
+                        (inchi_key, json.dumps(values)),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    log.warning("Writing %s to the molecule cache failed: %s" % (inchi_key, e))
+                    self._db.rollback()
+
+
+def get_molecule_cache():
+    """
+    Process-wide MoleculeCache, stored in
+    ckanext.massbankharvester.molecule_cache_path (default: below
+    ckan.storage_path)
+    """
+    global _molecule_cache
+    if _molecule_cache is None:
+        path = toolkit.config.get("ckanext.massbankharvester.molecule_cache_path")
+        if path is None and toolkit.config.get("ckan.storage_path"):
+            path = os.path.join(
+                toolkit.config.get("ckan.storage_path"),
+                "massbankharvester",
+                "molecules.sqlite",
+            )
+        _molecule_cache = MoleculeCache(
+            path,
+            maxsize=int(toolkit.config.get(
+                "ckanext.massbankharvester.molecule_cache_size", 10000)),
+        )
+    return _molecule_cache
+
+
+def prerender_images():
+    """
+    Whether the images of new molecules are queued for rendering during
+    the import (ckanext.massbankharvester.prerender_images)
+    """
+    return toolkit.asbool(toolkit.config.get(
+        "ckanext.massbankharvester.prerender_images", False))
+
+
+def lookup_molecule(inchi_key, standard_inchi):
+    """
+    Cached compute_molecule() values of a molecule, None if its InChI is
+    invalid.
+
+    Images are drawn on request by the /molecule/<inchi_key>.png view. With
+    ckanext.massbankharvester.prerender_images the image of a molecule is
+    queued for rendering the first time it is seen, unless the file exists.
+    """
+    cache = get_molecule_cache()
+    values = cache.get(inchi_key)
+    if values is None:
+        values = compute_molecule(inchi_key, standard_inchi)
+        if values is None:
+            return None
+        # rendered in the background: ckan massbankharvester render-images
+        if prerender_images() and not os.path.isfile(values["image_path"]):
+            ImageQueueItem.enqueue(inchi_key, standard_inchi)
+            log.debug("Molecule image of %s queued", inchi_key)
+        cache.set(inchi_key, values)
+    return values
@@ -0,0 +1,90 @@
+import click
+
+from ckan.model import Session
+
+from ckanext.massbankharvester import db
+from ckanext.massbankharvester import images
+from ckanext.massbankharvester import indexing
+from ckanext.massbankharvester import jobs
+from ckanext.massbankharvester import metrics
+from ckanext.massbankharvester import profiling
+from ckanext.massbankharvester.model import ImageQueueItem
+from ckanext.massbankharvester.model import setup as model_setup
+
+
+@click.group(short_help="Massbank/nmrXiv harvester commands")
+def massbankharvester():
+    model_setup()
+
+
+@massbankharvester.command("render-images")
+@click.option("-p", "--processes", type=int, default=None,
+              help="Number of worker processes (default: number of cores)")
+@click.option("--retry-failed", is_flag=True,
+              help="Render molecules that failed before once more")
+def render_images(processes, retry_failed):
+    """Render the structure images of the queued molecules"""
+    if retry_failed:
+        Session.query(ImageQueueItem).update({"error": None})
+        Session.commit()
+    rendered, failed = images.drain_queue(processes=processes)
+    click.secho("%s images rendered, %s failed" % (rendered, failed), fg="green")
+
+
+@massbankharvester.command("backfill-images")
+def backfill_images():
+    """Queue all harvested molecules without a structure image"""
+    queued = images.backfill_queue()
+    click.secho("%s molecules queued" % queued, fg="green")
+
+
+@massbankharvester.command("migrate-images")
+def migrate_images():
+    """Move the images of the flat image directory into shard directories"""
+    moved = images.migrate_flat_dir()
+    click.secho("%s images moved" % moved, fg="green")
+
+
+@massbankharvester.command("job-timings")
+@click.argument("harvest_job_id")
+def job_timings(harvest_job_id):
+    """Show the step timings of a harvest job"""
+    click.echo(metrics.format_job_summary(harvest_job_id))
+
+
+@massbankharvester.command("finish-jobs")
+def finish_jobs():
+    """Log the timings and merge the profiles of the finished jobs"""
+    handled = jobs.finish_jobs()
+    click.secho("%s jobs finished" % len(handled), fg="green")
+
+
+@massbankharvester.command("index-queued")
+def index_queued():
+    """Index the packages queued with the "batch" index mode"""
+    indexed = indexing.index_queued()
+    click.secho("%s packages indexed" % indexed, fg="green")
+
+
+@massbankharvester.command("merge-profiles")
+@click.argument("harvest_job_id")
+def merge_profiles(harvest_job_id):
+    """Merge the stage profiles of a harvest job"""
+    merged = profiling.get_stage_profiler().merge(harvest_job_id)
+    for path in merged:
+        click.echo(path)
+    if not merged:
+        click.secho("No profiles of job %s" % harvest_job_id, fg="yellow")
+
+
+@massbankharvester.command("upgrade-chemistry-db")
+def upgrade_chemistry_db():
+    """Add the constraints and indexes of the chemistry tables to their database"""
+    with db.get_engine().begin() as connection:
+        db.add_unique_constraints(connection)
+        db.add_inchi_key_index(connection)
+    click.secho("Chemistry tables are up to date", fg="green")
+
+
+def get_commands():
+    return [massbankharvester]
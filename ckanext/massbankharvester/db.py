@@ -0,0 +1,146 @@
+import logging
+
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine
+from sqlalchemy import text
+
+from ckan import model
+import ckan.plugins.toolkit as toolkit
+
+log = logging.getLogger(__name__)
+
+_engine = None
+
+
+def uses_own_engine():
+    """
+    Whether the chemistry tables are in another database than CKAN's
+    """
+    return bool(toolkit.config.get("ckanext.massbankharvester.chemistry_db_url"))
+
+
+def get_engine():
+    """
+    Engine of the database with the chemistry tables (molecule_data,
+    related_resources).
+
+    This is the CKAN database (and connection pool) unless
+    ``ckanext.massbankharvester.chemistry_db_url`` points to another one,
+    in which case a pooled engine is created once per process.
+    """
+    global _engine
+    if _engine is None:
+        if uses_own_engine():
+            url = toolkit.config["ckanext.massbankharvester.chemistry_db_url"]
+            _engine = create_engine(
+                url,
+                pool_size=int(toolkit.config.get(
+                    "ckanext.massbankharvester.chemistry_db_pool_size", 5)),
+                pool_pre_ping=True,
+            )
+            log.debug("Created chemistry db engine for %s" % _engine.url)
+        else:
+            _engine = model.meta.engine
+    return _engine
+
+
+def write_chemistry(molecule, names=()):
+    """
+    Write the molecule_data and related_resources rows of one record with
+    one INSERT ... ON CONFLICT DO NOTHING per table, in a single
+    transaction on a pooled connection
+
+    The conflict targets are the unique constraints added by
+    add_unique_constraints().
+
+    :param molecule: molecule_data values without the id, starting with
+        the package id
+    :param names: (package_id, alternate_name) rows for related_resources
+    :raises: the database error, after rolling back
+    """
+    names = sorted(set(tuple(name) for name in names))
+    con = get_engine().raw_connection()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "INSERT INTO molecule_data VALUES "
+            "(nextval('molecule_data_id_seq'),%s,%s,%s,%s,%s,%s) "
+            "ON CONFLICT (package_id) DO NOTHING",
+            tuple(molecule),
+        )
+        if names:
+            execute_values(
+                cur,
+                "INSERT INTO related_resources(id,package_id,alternate_name) VALUES %s "
+                "ON CONFLICT (package_id, alternate_name) DO NOTHING",
+                names,
+                template="(nextval('related_resources_id_seq'),%s,%s)",
+            )
+        cur.close()
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        # back to the pool
+        con.close()
+
+
+UNIQUE_CONSTRAINTS = (
+    ("molecule_data", "molecule_data_package_id_key", ("package_id",)),
+    (
+        "related_resources",
+        "related_resources_package_id_alternate_name_key",
+        ("package_id", "alternate_name"),
+    ),
+)
+
+
+def _has_constraint(connection, name):
+    return connection.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name"), name=name
+    ).first() is not None
+
+
+def add_unique_constraints(connection):
+    """
+    Add the unique constraints write_chemistry() relies on, after dropping
+    the duplicates left by the former SELECT+INSERT writers. Constraints
+    that exist already are left alone.
+    """
+    for table, name, columns in UNIQUE_CONSTRAINTS:
+        if _has_constraint(connection, name):
+            continue
+        connection.execute(
+            "DELETE FROM {table} a USING {table} b WHERE {same} AND a.id > b.id".format(
+                table=table,
+                same=" AND ".join("a.{0} = b.{0}".format(column) for column in columns),
+            )
+        )
+        connection.execute(
+            "ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})".format(
+                table, name, ", ".join(columns)
+            )
+        )
+        log.info("Added constraint %s" % name)
+
+
+def add_inchi_key_index(connection):
+    """
+    Index of molecule_data.inchi_key, for the lookups of the molecule
+    image view
+    """
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS molecule_data_inchi_key_idx ON molecule_data (inchi_key)"
+    )
+
+
+def drop_inchi_key_index(connection):
+    connection.execute("DROP INDEX IF EXISTS molecule_data_inchi_key_idx")
+
+
+def drop_unique_constraints(connection):
+    for table, name, _ in reversed(UNIQUE_CONSTRAINTS):
+        connection.execute(
+            "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(table, name)
+        )
@@ -0,0 +1,765 @@
+import logging
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+
+import requests
+
+from ckan.model import Session
+from ckan.logic import get_action
+from ckan import model
+from ckan.model.types import make_uuid
+
+import ckan.plugins as p
+from ckanext.harvest.harvesters.base import HarvesterBase
+from ckan.lib.munge import munge_title_to_name
+from ckan.lib.search import rebuild
+from ckanext.harvest.model import HarvestObject
+
+from oaipmh.datestamp import datetime_to_datestamp
+
+from ckanext.massbankharvester.harvester.mapping import compile_profile
+from ckanext.massbankharvester.harvester.oai import get_client
+from ckanext.massbankharvester.harvester.oai import list_pages
+from ckanext.massbankharvester.harvester.oai import list_set_specs
+from ckanext.massbankharvester.harvester.partitions import DATESTAMP_FORMAT
+from ckanext.massbankharvester.harvester.partitions import list_partitions
+from ckanext.massbankharvester.harvester.partitions import plan_partitions
+from ckanext.massbankharvester.harvester.replay import get_response_cache
+from ckanext.massbankharvester import jsoncodec
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.chemistry import lookup_molecule
+from ckanext.massbankharvester.chemistry import prerender_images
+from ckanext.massbankharvester.db import write_chemistry
+from ckanext.massbankharvester.indexing import get_search_index_queue
+from ckanext.massbankharvester.metrics import Stopwatch
+from ckanext.massbankharvester.metrics import get_job_timings
+from ckanext.massbankharvester.model import CONTENT_HASH_KEY
+from ckanext.massbankharvester.model import GatherCheckpoint
+from ckanext.massbankharvester.model import GatherPartition
+from ckanext.massbankharvester.model import content_hash
+from ckanext.massbankharvester.model import get_current_datestamps
+from ckanext.massbankharvester.model import get_content_hash
+from ckanext.massbankharvester.model import get_datestamp_watermark
+from ckanext.massbankharvester.model import claim_waiting_objects
+from ckanext.massbankharvester.model import mark_unchanged
+from ckanext.massbankharvester.model import setup as model_setup
+from ckanext.massbankharvester.profiling import profile_stage
+
+log = logging.getLogger(__name__)
+
+# (harvest job id, source id, source config) -> harvester settings for import_stage
+_source_settings = LRUCache(maxsize=32)
+
+
+def describe_error(error):
+    """
+    Message of an exception for gather errors, with the status and the
+    start of the body of an HTTP error response
+    """
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return "HTTP %s %s: %s" % (
+            response.status_code, response.reason, response.text[:500]
+        )
+    return repr(error)
+
+
+class OAIJSONHarvester(HarvesterBase):
+    """
+    JSON-LD Harvester for OAI-PMH endpoints serving JSON containers.
+
+    The records are mapped to packages by a mapping profile (see
+    mapping.py), mapping_profile by default, or the "mapping" of the
+    harvest source config.
+    """
+
+    # name in profiles.PROFILES
+    mapping_profile = None
+
+    p.implements(p.IConfigurable)
+
+    def configure(self, config):
+        # create the gather checkpoint table
+        model_setup()
+
+    def info(self):
+        """
+        Return information about this harvester.
+        """
+        return {
+            "name": "OAI JSON-LD Harvester",
+            "title": "OAI JSON-LD Harvester",
+            "description": "Harvester for OAI Handler with BioSchemaOrg/JSON Container  ",
+        }
+
+    def gather_stage(self, harvest_job):
+        """
+
+        :param harvest_job: HarvestJob object
+        :returns: A list of HarvestObject ids
+        """
+        self.timings = get_job_timings(harvest_job.id, harvest_job.source.id)
+        with self.timings.time("gather_stage"):
+            harvest_obj_ids = self._gather(harvest_job)
+        self.timings.flush()
+        return harvest_obj_ids
+
+    def _gather(self, harvest_job):
+        log.debug("in gather stage: %s" % harvest_job.source.url)
+        try:
+            self._set_config(harvest_job.source.config, harvest_job.source.id)
+
+            # objects saved by an earlier, interrupted run of this job
+            harvest_obj_ids = []
+            saved_guids = set()
+            for obj_id, guid in Session.query(
+                    HarvestObject.id, HarvestObject.guid
+            ).filter(HarvestObject.harvest_job_id == harvest_job.id):
+                harvest_obj_ids.append(obj_id)
+                saved_guids.add(guid)
+
+            checkpoint = GatherCheckpoint.get_or_create(harvest_job.id)
+            if checkpoint.finished:
+                log.debug("Gather of job %s already finished" % harvest_job.id)
+                return harvest_obj_ids
+            if checkpoint.resumption_token:
+                log.info(
+                    "Resuming gather of job %s at token %s (%s objects saved)"
+                    % (harvest_job.id, checkpoint.resumption_token, len(harvest_obj_ids))
+                )
+
+            client = self._get_client(harvest_job.source.url)
+
+            client.identify()  # check if identify works
+
+            partitioned = bool(self.partition_sets or self.partition_days)
+            if partitioned:
+                streams = self._partition_pages(client, harvest_job)
+            else:
+                streams = ((checkpoint, page) for page in self._list_pages(
+                    client, checkpoint.resumption_token
+                ))
+
+            # datestamps of the records imported by earlier jobs
+            current_datestamps = {}
+            if self.skip_unchanged:
+                current_datestamps = get_current_datestamps(harvest_job.source.id)
+            skipped = 0
+
+            pending = []
+            # checkpoint -> resumptionToken of its next page, saved with pending
+            progress = {}
+            # checkpoint -> objects created for it, also by earlier runs
+            counts = {}
+            # time spent in requesting and parsing the pages
+            watch = Stopwatch()
+            for stream, page in watch.iterate(streams):
+                if stream not in counts:
+                    counts[stream] = stream.object_count or 0
+                if page is None:
+                    # a partition without records
+                    progress[stream] = None
+                    continue
+                for item in watch.iterate(page):
+                    if self.list_records:
+                        header, metadata, _ = item
+                        if header.isDeleted() or metadata is None:
+                            log.debug("Skipping deleted record %s" % header.identifier())
+                            continue
+                    else:
+                        header, metadata = item, None
+                    # also drops the records listed by several partitions
+                    if header.identifier() in saved_guids:
+                        continue
+                    last_datestamp = current_datestamps.get(header.identifier())
+                    if last_datestamp and header.datestamp() <= last_datestamp:
+                        skipped += 1
+                        continue
+
+                    harvest_obj = HarvestObject(
+                        id=make_uuid(),
+                        guid=header.identifier(),
+                        harvest_job_id=harvest_job.id,
+                        harvest_source_id=harvest_job.source.id,
+                        metadata_modified_date=header.datestamp()
+                    )
+                    if metadata is not None:
+                        try:
+                            harvest_obj.content = self._get_content(header, metadata)
+                        except Exception:
+                            # saved without content: fetch_stage requests it
+                            # once more and reports the error on the object
+                            log.exception(
+                                "Dumping the metadata of %s failed" % header.identifier()
+                            )
+                    pending.append(harvest_obj)
+                    saved_guids.add(harvest_obj.guid)
+                    counts[stream] += 1
+
+                if page.error is not None:
+                    # cut short; the end of its partition reports the error
+                    continue
+                # only flush on page boundaries, so that the checkpoint
+                # token always belongs to the last committed page
+                progress[stream] = page.token
+                self.timings.observe("oai_list_page", watch.reset())
+                if len(pending) >= self.batch_size:
+                    harvest_obj_ids.extend(
+                        self._save_harvest_objects(pending, progress, counts)
+                    )
+                    pending = []
+                    progress = {}
+
+            if not partitioned and checkpoint not in counts:
+                # nothing to list (noRecordsMatch)
+                progress[checkpoint] = None
+                counts[checkpoint] = checkpoint.object_count or 0
+            harvest_obj_ids.extend(
+                self._save_harvest_objects(pending, progress, counts)
+            )
+            # a partitioned gather is done once all of its partitions are
+            if partitioned and all(
+                    partition.finished for partition in GatherPartition.for_job(harvest_job.id)
+            ):
+                checkpoint.update(None, len(harvest_obj_ids))
+                Session.commit()
+            if skipped:
+                log.info("Skipped %s unchanged records" % skipped)
+
+        except requests.HTTPError as e:
+            log.exception(
+                "Gather stage failed on %s: %s" % (harvest_job.source.url, describe_error(e))
+            )
+            self._save_gather_error(
+                "Could not gather anything from %s: %s"
+                % (harvest_job.source.url, describe_error(e)),
+                harvest_job,
+            )
+            return None
+        except (Exception) as e:
+            log.exception(
+                "Gather stage failed on %s: %s"
+                % (
+                    harvest_job.source.url,
+                    str(e),
+                )
+            )
+            self._save_gather_error(
+                "Could not gather anything from %s: %s / %s"
+                % (harvest_job.source.url, str(e), traceback.format_exc()),
+                harvest_job,
+            )
+            return None
+        log.debug(
+            "Gather stage successfully finished with %s harvest objects"
+            % len(harvest_obj_ids)
+        )
+        return harvest_obj_ids
+
+    def _save_harvest_objects(self, harvest_objects, progress, counts):
+        """
+        Insert a batch of HarvestObjects with a single commit, together with
+        the checkpoints of the job or of its partitions
+
+        :param progress: dict of checkpoint -> resumptionToken of its next page
+        :param counts: dict of checkpoint -> number of objects created for it
+        :returns: the ids of the new HarvestObjects
+        """
+        with self.timings.time("gather_save"):
+            Session.bulk_save_objects(harvest_objects)
+            for checkpoint, token in progress.items():
+                checkpoint.update(token, counts[checkpoint])
+            Session.commit()
+        log.debug("%s harvest objects created" % len(harvest_objects))
+        return [harvest_obj.id for harvest_obj in harvest_objects]
+
+    def _partition_pages(self, client, harvest_job):
+        """
+        List the partitions of the job that are not finished yet with
+        gather_concurrency threads, see partitions.list_partitions. A new
+        job takes over the partitions earlier jobs of the source did not
+        finish, as the datestamp watermark may have moved past them.
+
+        :returns: generator of (GatherPartition, page or None)
+        """
+        partitions = GatherPartition.for_job(harvest_job.id)
+        if not partitions:
+            set_specs = [self.set_spec]
+            if self.partition_sets and not self.set_spec:
+                set_specs = list_set_specs(client)
+            planned = plan_partitions(
+                set_specs, self.set_from, self.set_until, self.partition_days
+            )
+            unfinished = GatherPartition.unfinished_of_source(
+                harvest_job.source.id, harvest_job.id
+            )
+            for partition in unfinished:
+                window = (partition.set_spec, partition.from_datestamp, partition.until_datestamp)
+                if window not in planned:
+                    planned.append(window)
+            partitions = GatherPartition.create_all(
+                harvest_job.id, planned, replaces=unfinished
+            )
+            log.info(
+                "Gathering job %s in %s partitions (%s left by earlier jobs)"
+                % (harvest_job.id, len(partitions), len(unfinished))
+            )
+        else:
+            log.info(
+                "Resuming gather of job %s (%s of %s partitions finished)"
+                % (harvest_job.id, sum(p.finished for p in partitions), len(partitions))
+            )
+        partitions = [partition for partition in partitions if not partition.finished]
+
+        def partition_pages(partition):
+            return self._list_pages(
+                client,
+                partition.resumption_token,
+                partition.set_spec,
+                partition.from_datestamp,
+                partition.until_datestamp,
+            )
+
+        for partition, page in list_partitions(
+                partitions, partition_pages, self.gather_concurrency
+        ):
+            if isinstance(page, Exception):
+                log.error("Gathering %r failed: %s" % (partition, describe_error(page)))
+                self._save_gather_error(
+                    "Could not gather %r from %s, the next job gathers it again: %s"
+                    % (partition, harvest_job.source.url, describe_error(page)),
+                    harvest_job,
+                )
+                continue
+            yield partition, page
+
+    def _list_pages(self, client, resumption_token=None, set_spec=None,
+                    set_from=None, set_until=None):
+        """
+        The pages of the source, or of a set and date range of it
+        """
+        if self.list_records:
+            return self._record_generator(
+                client, resumption_token, set_spec, set_from, set_until
+            )
+        return self._identifier_generator(
+            client, resumption_token, set_spec, set_from, set_until
+        )
+
+    def _list_arguments(self, set_spec=None, set_from=None, set_until=None):
+        """
+        pyoai generates the URL based on the given method parameters
+        Therefore one may not use the set parameter if it is not there
+        """
+        set_spec = set_spec or self.set_spec
+        set_from = set_from or self.set_from
+        set_until = set_until or self.set_until
+        if set_from or set_until or set_spec:
+            return {
+                "metadataPrefix": self.md_format,
+                "set": set_spec,
+                "from": datetime_to_datestamp(datetime.strptime(set_from, DATESTAMP_FORMAT)),
+                "until": datetime_to_datestamp(datetime.strptime(set_until, DATESTAMP_FORMAT)),
+            }
+        return {"metadataPrefix": self.md_format}
+
+    def _identifier_generator(self, client, resumption_token=None, *partition):
+        """
+        The headers of the source, one ListIdentifiers page (oai.Page) at
+        a time
+
+        :param partition: set_spec, set_from and set_until instead of the
+            ones of the source config
+        """
+        return list_pages(
+            client, "ListIdentifiers", resumption_token, **self._list_arguments(*partition)
+        )
+
+    def _record_generator(self, client, resumption_token=None, *partition):
+        """
+        Same as _identifier_generator, but uses ListRecords so that the
+        metadata comes along with each header ("list_records" mode)
+        """
+        return list_pages(
+            client, "ListRecords", resumption_token, **self._list_arguments(*partition)
+        )
+
+    def _get_client(self, url):
+        """
+        OAI-PMH client of the source, with the limits of its config
+        """
+        return get_client(
+            url,
+            self.credentials,
+            force_http_get=self.force_http_get,
+            rate_limit=self.rate_limit,
+            # the most a worker sends at once: one per prefetching or
+            # partition listing thread
+            max_concurrency=max(1, self.fetch_concurrency, self.gather_concurrency),
+            max_retries=self.max_retries,
+            cache=get_response_cache(self.http_cache),
+        )
+
+    def _set_config(self, source_config, source_id=None):
+        """
+        :param source_id: if given and the config has no "from", harvest
+            incrementally from the newest datestamp imported for the source
+        """
+
+        now = datetime.now()
+        yesterday = now - timedelta(days=5)
+
+        try:
+            config_json = json.loads(source_config)
+            log.debug("config_json: %s" % config_json)
+            try:
+                username = config_json["username"]
+                password = config_json["password"]
+                self.credentials = (username, password)
+            except (IndexError, KeyError):
+                self.credentials = None
+
+            self.user = "harvest"
+            self.set_spec = config_json.get("set", None)
+            self.md_format = config_json.get("metadata_prefix", "oai_dc")
+            self.overlap = timedelta(minutes=config_json.get("overlap_minutes", 60))
+            if source_id and "from" not in config_json:
+                watermark = get_datestamp_watermark(source_id)
+                if watermark:
+                    log.debug("Newest imported datestamp: %s" % watermark)
+                    yesterday = watermark - self.overlap
+            self.set_from = config_json.get("from",str(yesterday.strftime("%Y-%m-%dT%H:%M:%SZ")))
+            self.set_until = config_json.get("until",str(now.strftime("%Y-%m-%dT%H:%M:%SZ")))
+            self.force_http_get = config_json.get("force_http_get", False)
+            self.list_records = config_json.get("list_records", False)
+            self.batch_size = config_json.get("gather_batch_size", 1000)
+            self.skip_unchanged = config_json.get("skip_unchanged", True)
+            self.index_mode = config_json.get("index_mode", "rebuild")
+            self.prefetch_window = config_json.get("prefetch_window", 0)
+            self.fetch_concurrency = config_json.get("fetch_concurrency", 4)
+            # parallel gather by OAI set and/or date window, see partitions.py
+            self.partition_sets = config_json.get("partition_sets", False)
+            self.partition_days = config_json.get("partition_days")
+            self.gather_concurrency = config_json.get("gather_concurrency", 4)
+            self.rate_limit = config_json.get("rate_limit", 0)
+            self.max_retries = config_json.get("max_retries", 5)
+            self.http_cache = config_json.get("http_cache")
+            # profile name or declaration, see mapping.py
+            self.mapping_config = config_json.get("mapping", self.mapping_profile)
+
+        except ValueError:
+            pass
+
+    def fetch_stage(self, harvest_object):
+        """
+        The fetch stage will receive a HarvestObject object and will be
+        responsible for:
+            - getting the contents of the remote object (e.g. for a CSW server,
+              perform a GetRecordById request).
+            - saving the content in the provided HarvestObject.
+            - creating and storing any suitable HarvestObjectErrors that may
+              occur.
+            - returning True if everything went as expected, False otherwise.
+
+        :param harvest_object: HarvestObject object
+        :returns: True if everything went right, False if errors were found
+        """
+        self.timings = get_job_timings(
+            harvest_object.harvest_job_id, harvest_object.harvest_source_id
+        )
+        with profile_stage("fetch_stage", harvest_object), \
+                self.timings.time("fetch_stage"):
+            return self._fetch(harvest_object)
+
+    def _fetch(self, harvest_object):
+        log.debug("in fetch stage: %s" % harvest_object.guid)
+        if harvest_object.content:
+            # already filled during gather ("list_records" mode) or
+            # prefetched along with another object ("prefetch_window")
+            log.debug("Content for %s already gathered" % harvest_object.guid)
+            return True
+        try:
+            self._set_config(harvest_object.job.source.config)
+            client = self._get_client(harvest_object.job.source.url)
+
+            if self.prefetch_window:
+                self._prefetch_records(harvest_object, client)
+                if harvest_object.content:
+                    return True
+                # fetch it once more on its own to report the error
+
+            record = None
+            try:
+                log.debug(
+                    "Load %s with metadata prefix '%s'"
+                    % (harvest_object.guid, self.md_format)
+                )
+
+                self._before_record_fetch(harvest_object)
+
+                with self.timings.time("oai_get_record"):
+                    record = client.getRecord(
+                        identifier=harvest_object.guid,
+                        metadataPrefix=self.md_format,
+                    )
+                self._after_record_fetch(record)
+                log.debug("record found!")
+            except:
+                log.exception("getRecord failed for %s" % harvest_object.guid)
+                self._save_object_error(
+                    "Get record failed for %s!" % harvest_object.guid,
+                    harvest_object,
+                )
+                return False
+
+            header, metadata, _ = record
+            try:
+                content = self._get_content(header, metadata)
+            except:
+                log.exception("Dumping the metadata failed!")
+                self._save_object_error(
+                    "Dumping the metadata failed!", harvest_object
+                )
+                return False
+
+            harvest_object.content = content
+            harvest_object.save()
+        except (Exception) as e:
+            log.exception(e)
+            self._save_object_error(
+                "Exception in fetch stage for %s: %r / %s"
+                % (harvest_object.guid, e, traceback.format_exc()),
+                harvest_object,
+            )
+            return False
+
+        return True
+
+    def _before_record_fetch(self, harvest_object):
+        pass
+
+    def _after_record_fetch(self, record):
+        pass
+
+    def _prefetch_records(self, harvest_object, client):
+        """
+        Fetch the records of harvest_object and of up to prefetch_window
+        other waiting objects of its job with fetch_concurrency parallel
+        requests, and save all contents with a single commit. Only objects
+        no other worker claimed are fetched; the rest, and records that
+        fail, are left to their own fetch_stage call.
+        """
+        harvest_objects = claim_waiting_objects(harvest_object, self.prefetch_window)
+        if not harvest_objects:
+            return
+
+        def fetch(obj):
+            self._before_record_fetch(obj)
+            with self.timings.time("oai_get_record"):
+                record = client.getRecord(
+                    identifier=obj.guid,
+                    metadataPrefix=self.md_format,
+                )
+            self._after_record_fetch(record)
+            return record
+
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency) as executor:
+            futures = [(obj, executor.submit(fetch, obj)) for obj in harvest_objects]
+
+        fetched = 0
+        for obj, future in futures:
+            try:
+                header, metadata, _ = future.result()
+                obj.content = self._get_content(header, metadata)
+            except Exception as e:
+                log.debug("Prefetching %s failed: %r" % (obj.guid, e))
+                continue
+            Session.add(obj)
+            fetched += 1
+        Session.commit()
+        log.debug("Prefetched %s of %s records" % (fetched, len(harvest_objects)))
+
+    def _get_content(self, header, metadata):
+        """
+        Normalize the JSON container of a record into the JSON string
+        stored as HarvestObject content
+        """
+        try:
+            metadata_modified = header.datestamp().isoformat()
+        except:
+            metadata_modified = None
+        content_dict = metadata.getMap()
+        with self.timings.time("json_normalize"):
+            data, expected_finalValue = jsoncodec.normalize_container(
+                content_dict['json_data']
+            )
+        content_dict["set_spec"] = header.setSpec()
+        if metadata_modified:
+            content_dict["metadata_modified"] = metadata_modified
+        log.debug(expected_finalValue)
+        return data
+
+    def import_stage(self, harvest_object):
+        """
+        The import stage will receive a HarvestObject object and will be
+        responsible for:
+            - performing any necessary action with the fetched object (e.g
+              create a CKAN package).
+              Note: if this stage creates or updates a package, a reference
+              to the package must be added to the HarvestObject.
+              Additionally, the HarvestObject must be flagged as current.
+            - creating the HarvestObject - Package relation (if necessary)
+            - creating and storing any suitable HarvestObjectErrors that may
+              occur.
+            - returning True if everything went as expected, False otherwise.
+
+        :param harvest_object: HarvestObject object
+        :returns: True if everything went right, False if errors were found
+        """
+        if not harvest_object:
+            log.error("No harvest object received")
+            self._save_object_error("No harvest object received")
+            return False
+
+        self.timings = get_job_timings(
+            harvest_object.harvest_job_id, harvest_object.harvest_source_id
+        )
+        with profile_stage("import_stage", harvest_object), \
+                self.timings.time("import_stage"):
+            result = self._import(harvest_object)
+        self._index_queued(harvest_object)
+        return result
+
+    def _import(self, harvest_object):
+        log.debug("in import stage: %s" % harvest_object.guid)
+        try:
+            self._set_source_settings(harvest_object)
+            with self.timings.time("json_parse"):
+                content = jsoncodec.loads(harvest_object.content)
+            package_id = munge_title_to_name(harvest_object.guid)
+
+            # nothing to do if the record did not change since its last import
+            record_hash = content_hash(content)
+            if self.skip_unchanged and get_content_hash(package_id) == record_hash:
+                log.debug("Content of %s unchanged" % harvest_object.guid)
+                mark_unchanged(harvest_object, package_id)
+                return "unchanged"
+
+            with self.timings.time("mapping"):
+                record = self.mapping.apply(
+                    content, self._lookup_molecule if self.needs_molecule else None
+                )
+            package_dict = dict(record.package)
+            package_dict["id"] = package_id
+            package_dict["name"] = package_id
+            package_dict["owner_org"] = self.owner_org
+            package_dict["resources"] = record.resources
+            package_dict["extras"] = record.extras + [
+                {"key": CONTENT_HASH_KEY, "value": record_hash}
+            ]
+
+            log.debug("Create/update package using dict: %s" % package_dict)
+            with self.timings.time("create_or_update_package"):
+                self._create_or_update_package(
+                    package_dict, harvest_object, "package_show"
+                )
+
+            # package_create/package_update already indexed the package,
+            # "rebuild" indexes it once more for compatibility
+            with self.timings.time("search_index"):
+                if self.index_mode == "rebuild":
+                    rebuild(package_dict["name"])
+                elif self.index_mode == "batch":
+                    get_search_index_queue().add(
+                        package_dict["id"], harvest_object.harvest_job_id
+                    )
+            Session.commit()
+
+            if record.chemistry is not None:
+                with self.timings.time("send_to_db"):
+                    self._send_to_db(package_id, record.chemistry)
+
+            log.debug("Finished record")
+
+        except (Exception) as e:
+            log.exception(e)
+            self._save_object_error(
+                "Exception in fetch stage for %s: %r / %s"
+                % (harvest_object.guid, e, traceback.format_exc()),
+                harvest_object,
+            )
+            return False
+        return True
+
+    def _lookup_molecule(self, inchi_key, standard_inchi):
+        with self.timings.time("molecule"):
+            return lookup_molecule(inchi_key, standard_inchi)
+
+    def _set_source_settings(self, harvest_object):
+        """
+        Same as _set_config, plus the owner_org of the harvest source and
+        the compiled mapping. All are looked up once per job and config
+        revision of the source.
+        """
+        source = harvest_object.job.source
+        key = (harvest_object.harvest_job_id, source.id, source.config)
+        settings = _source_settings.get(key)
+        if settings is None:
+            self._set_config(source.config)
+            context = {
+                "model": model,
+                "session": Session,
+                "user": self.user,
+                "ignore_auth": True,
+            }
+            source_dataset = get_action("package_show")(context, {"id": source.id})
+            self.owner_org = source_dataset.get("owner_org")
+            self.mapping = compile_profile(self.mapping_config)
+            # RDKit only parses the InChI if the values are used
+            self.needs_molecule = self.mapping.uses_molecule or prerender_images()
+            settings = dict(self.__dict__)
+            # set by import_stage for each object
+            settings.pop("timings", None)
+            _source_settings.set(key, settings)
+        else:
+            self.__dict__.update(settings)
+
+    def _index_queued(self, harvest_object):
+        """
+        Index the packages queued by "index_mode": "batch" once this worker
+        queued a batch of them or the oldest one waited long enough
+        """
+        if getattr(self, "index_mode", None) != "batch":
+            return
+        queue = get_search_index_queue()
+        if not queue.due():
+            return
+        with self.timings.time("search_index"):
+            try:
+                queue.index(harvest_object.harvest_job_id)
+            except Exception:
+                # the packages stay queued for the next try
+                log.exception("Indexing the queued packages failed")
+
+    def _send_to_db(self, package_id, chemistry):
+        """
+        Write the molecule_data and related_resources rows of a record; a
+        failure fails the import of the record
+
+        :param chemistry: the "chemistry" values of the mapping profile
+        """
+        write_chemistry(
+            (
+                package_id,
+                json.dumps(chemistry["inchi"]),
+                chemistry["smiles"],
+                chemistry["inchi_key"],
+                chemistry["exact_mass"],
+                chemistry["mol_formula"],
+            ),
+            [(package_id, name) for name in chemistry["alternate_names"]],
+        )
+        log.debug("data sent to db")
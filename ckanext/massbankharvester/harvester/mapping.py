@@ -0,0 +1,281 @@
+"""
+Declarative mapping of harvested JSON records to CKAN packages.
+
+A profile (see profiles.py) declares where the values of a record are:
+
+    {
+        "package": {"title": {"path": "name", "required": True}, ...},
+        "resources": [{"url": "url", "name": "name", ...}],
+        "extras": {"inchi_key": "inchikey", ...},
+        "molecule": {"inchi": "inChI", "inchi_key": "inchikey"},
+        "chemistry": {"inchi": "inChI", "exact_mass": ..., ...},
+    }
+
+Each value is either a path or a dict with these keys:
+
+* ``path``: dotted path into the record, with object keys and array
+  indexes, e.g. ``1.about.hasBioChemEntityPart.0.inChIKey``; or a list of
+  paths, the first one present is used
+* ``molecule``: instead of a path, a value computed by RDKit for the
+  molecule of the record (``mol_weight``, ``exact_mass``, ``formula``)
+* ``convert``: one of CONVERTERS
+* ``default``: value if the path is missing
+* ``required``: fail the record if the value is missing
+
+compile_profile() turns the paths into accessor functions once, so that
+applying a profile to a record does no parsing of paths and no
+try/except per lookup. Missing values and JSON nulls are skipped.
+"""
+import json
+import logging
+
+from dateutil.parser import parse as parse_date
+
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.harvester.profiles import PROFILES
+
+log = logging.getLogger(__name__)
+
+# marks a missing value, as opposed to a JSON null
+MISSING = object()
+
+# profile (as JSON) -> CompiledProfile
+_compiled = LRUCache(maxsize=32)
+
+SECTIONS = ("package", "resources", "extras", "molecule", "chemistry")
+CHEMISTRY_COLUMNS = (
+    "inchi", "smiles", "inchi_key", "exact_mass", "mol_formula", "alternate_names",
+)
+
+
+class MappingError(Exception):
+    pass
+
+
+def _first(value):
+    if value.__class__ is list:
+        return value[0] if value else MISSING
+    return value
+
+
+def _join(value):
+    if value.__class__ is list:
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+def _as_list(value):
+    return value if value.__class__ is list else [value]
+
+
+def _datetime(value):
+    """
+    ISO 8601 without the time zone
+    """
+    if not value:
+        return MISSING
+    try:
+        return parse_date(value).replace(tzinfo=None).isoformat()
+    except (TypeError, ValueError, OverflowError):
+        log.debug("Invalid date %r" % (value,))
+        return MISSING
+
+
+CONVERTERS = {
+    "first": _first,
+    "join": _join,
+    "list": _as_list,
+    "datetime": _datetime,
+}
+
+
+def compile_path(path):
+    """
+    Accessor function for a dotted path
+
+    :returns: function(record) -> value, or MISSING
+    """
+    lines = ["def get(value):"]
+    for segment in str(path).split("."):
+        if segment.lstrip("-").isdigit():
+            index = int(segment)
+            size = index + 1 if index >= 0 else -index
+            lines.append(
+                "    if value.__class__ is not list or len(value) < %d: return MISSING" % size
+            )
+            lines.append("    value = value[%d]" % index)
+        else:
+            lines.append(
+                "    value = value.get(%r, MISSING) if value.__class__ is dict else MISSING"
+                % segment
+            )
+            lines.append("    if value is MISSING: return MISSING")
+    lines.append("    return MISSING if value is None else value")
+    namespace = {"MISSING": MISSING}
+    exec(compile("\n".join(lines), "<path %s>" % path, "exec"), namespace)
+    return namespace["get"]
+
+
+class Field(object):
+    """
+    A compiled value spec of a profile
+    """
+
+    def __init__(self, name, spec):
+        if not isinstance(spec, dict):
+            spec = {"path": spec}
+        unknown = set(spec) - {"path", "molecule", "convert", "default", "required"}
+        if unknown:
+            raise MappingError("Unknown options %s of %s" % (sorted(unknown), name))
+        if ("path" in spec) == ("molecule" in spec):
+            raise MappingError("%s needs either a path or a molecule value" % name)
+        if spec.get("convert") not in (None,) + tuple(CONVERTERS):
+            raise MappingError("Unknown convert %r of %s" % (spec["convert"], name))
+        self.name = name
+        self.molecule_key = spec.get("molecule")
+        paths = spec.get("path")
+        if paths is not None and not isinstance(paths, list):
+            paths = [paths]
+        self.getters = [compile_path(path) for path in paths or ()]
+        self.convert = CONVERTERS.get(spec.get("convert"))
+        self.default = spec.get("default", MISSING)
+        self.required = bool(spec.get("required"))
+
+    def get(self, record, molecule):
+        """
+        :raises MappingError: if a required value is missing
+        """
+        value = MISSING
+        if self.molecule_key is not None:
+            if molecule is not None:
+                value = molecule.get(self.molecule_key, MISSING)
+        else:
+            for getter in self.getters:
+                value = getter(record)
+                if value is not MISSING:
+                    break
+        if value is not MISSING and self.convert is not None:
+            value = self.convert(value)
+        if value is MISSING:
+            if self.required:
+                raise MappingError("Missing %s" % self.name)
+            value = self.default
+        return value
+
+
+class MappedRecord(object):
+    """
+    What a profile found in a record: package fields, resources and
+    extras for package_create/package_update, the chemistry table values
+    and the RDKit values of the molecule (None if there is none)
+    """
+
+    def __init__(self, package, resources, extras, chemistry, molecule):
+        self.package = package
+        self.resources = resources
+        self.extras = extras
+        self.chemistry = chemistry
+        self.molecule = molecule
+
+
+class CompiledProfile(object):
+
+    def __init__(self, profile):
+        unknown = set(profile) - set(SECTIONS)
+        if unknown:
+            raise MappingError("Unknown mapping sections %s" % sorted(unknown))
+
+        def fields(section, specs):
+            return [(key, Field("%s.%s" % (section, key), spec)) for key, spec in specs.items()]
+
+        self.package = fields("package", profile.get("package", {}))
+        self.resources = [
+            fields("resources.%s" % i, resource)
+            for i, resource in enumerate(profile.get("resources", []))
+        ]
+        self.extras = fields("extras", profile.get("extras", {}))
+        self.chemistry = fields("chemistry", profile.get("chemistry", {}))
+        unknown = set(dict(self.chemistry)) - set(CHEMISTRY_COLUMNS)
+        if unknown:
+            raise MappingError("Unknown chemistry columns %s" % sorted(unknown))
+
+        molecule = profile.get("molecule")
+        if molecule is not None and set(molecule) != {"inchi", "inchi_key"}:
+            raise MappingError("molecule needs exactly an inchi and an inchi_key")
+        self.molecule = molecule and (
+            Field("molecule.inchi", molecule["inchi"]),
+            Field("molecule.inchi_key", molecule["inchi_key"]),
+        )
+        # whether any value comes from the RDKit values of the molecule
+        self.uses_molecule = any(
+            field.molecule_key is not None
+            for _, field in self.package + self.extras + self.chemistry + sum(self.resources, [])
+        )
+        if self.uses_molecule and not self.molecule:
+            raise MappingError("molecule values need a molecule section")
+
+    def apply(self, record, lookup_molecule=None):
+        """
+        :param lookup_molecule: function(inchi_key, inchi) -> dict of RDKit
+            values or None, called for records with a standard InChI. Not
+            needed unless uses_molecule.
+        :raises MappingError: if a required value is missing
+        """
+        molecule = None
+        if self.molecule and lookup_molecule is not None:
+            inchi = self.molecule[0].get(record, None)
+            inchi_key = self.molecule[1].get(record, None)
+            if inchi.__class__ is str and inchi.startswith("InChI") and inchi_key is not MISSING:
+                molecule = lookup_molecule(inchi_key, inchi)
+
+        package = {}
+        for key, field in self.package:
+            value = field.get(record, molecule)
+            if value is not MISSING:
+                package[key] = value
+
+        resources = []
+        for resource_fields in self.resources:
+            resource = {}
+            for key, field in resource_fields:
+                value = field.get(record, molecule)
+                if value is not MISSING:
+                    resource[key] = value
+            if resource.get("url"):
+                resources.append(resource)
+
+        extras = []
+        for key, field in self.extras:
+            value = field.get(record, molecule)
+            if value is not MISSING:
+                extras.append({"key": key, "value": value})
+
+        chemistry = None
+        if self.chemistry:
+            chemistry = dict.fromkeys(CHEMISTRY_COLUMNS)
+            chemistry["alternate_names"] = []
+            for key, field in self.chemistry:
+                value = field.get(record, molecule)
+                if value is not MISSING:
+                    chemistry[key] = value
+
+        return MappedRecord(package, resources, extras, chemistry, molecule)
+
+
+def compile_profile(profile):
+    """
+    Compiled mapping of a profile, by name (see profiles.PROFILES) or as
+    dict, e.g. from the "mapping" option of a harvest source config
+
+    :raises MappingError: if the profile is unknown or invalid
+    """
+    if not isinstance(profile, dict):
+        if profile not in PROFILES:
+            raise MappingError("Unknown mapping profile %r" % (profile,))
+        profile = PROFILES[profile]
+    key = json.dumps(profile, sort_keys=True)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = CompiledProfile(profile)
+        _compiled.set(key, compiled)
+    return compiled
@@ -1,14 +1,27 @@
-from oaipmh.metadata import MetadataReader
+from oaipmh.common import Metadata
+from oaipmh.metadata import MetadataRegistry
 
-json_container_reader = MetadataReader(
-fields = {
-    'json_data': ('textList','jc:json/text()'),
+JSON_CONTAINER_NS = 'http://denbi.de/schemas/json-container'
+JSON_TAG = '{%s}json' % JSON_CONTAINER_NS
 
-},
-namespaces={
-        'oai' : 'http://www.openarchives.org/OAI/2.0/',
-        #'oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/',
-        'jc':'http://denbi.de/schemas/json-container',
 
-   }
-)
\ No newline at end of file
+def json_container_reader(element):
+    """
+    Reads the jc:json text of an oai:metadata element into a Metadata object
+    with a 'json_data' list, like a MetadataReader with the
+    ('textList', 'jc:json/text()') field, but without building an XPath
+    evaluator for every record.
+    """
+    json_data = []
+    for json_element in element.iterchildren(JSON_TAG):
+        if json_element.text:
+            json_data.append(json_element.text)
+        for child in json_element:
+            if child.tail:
+                json_data.append(child.tail)
+    return Metadata(element, {'json_data': json_data})
+
+
+# shared by all clients of the harvesters
+metadata_registry = MetadataRegistry()
+metadata_registry.registerReader("json_container", json_container_reader)
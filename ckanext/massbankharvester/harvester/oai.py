@@ -0,0 +1,403 @@
+import logging
+import time
+from urllib.parse import urlparse
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+from oaipmh import error
+from oaipmh.client import BaseClient
+from oaipmh.client import Client
+from oaipmh.client import buildHeader
+from oaipmh.error import BadResumptionTokenError
+from oaipmh.error import NoRecordsMatchError
+from oaipmh.error import NoSetHierarchyError
+
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.harvester.metadata import metadata_registry
+from ckanext.massbankharvester.harvester.ratelimit import backoff_delay
+from ckanext.massbankharvester.harvester.ratelimit import get_limiter
+from ckanext.massbankharvester.harvester.ratelimit import parse_retry_after
+
+log = logging.getLogger(__name__)
+
+# (base url, credentials, force_http_get, limits) -> SessionClient of this worker
+_clients = LRUCache(maxsize=16)
+
+OAI_NS = "http://www.openarchives.org/OAI/2.0/"
+OAI_NAMESPACES = {"oai": OAI_NS}
+_HEADER = "{%s}header" % OAI_NS
+_RECORD = "{%s}record" % OAI_NS
+_METADATA = "{%s}metadata" % OAI_NS
+_TOKEN = "{%s}resumptionToken" % OAI_NS
+_ERROR = "{%s}error" % OAI_NS
+# responses that lower the concurrency of the host, and all retried ones
+THROTTLE_STATUS = (429, 503)
+RETRY_STATUS = THROTTLE_STATUS + (500, 502, 504)
+
+_ERROR_CODES = (
+    "badArgument", "badResumptionToken", "badVerb", "cannotDisseminateFormat",
+    "idDoesNotExist", "noRecordsMatch", "noMetadataFormats", "noSetHierarchy",
+)
+
+
+class SessionClient(Client):
+    """
+    pyoai Client that sends its requests through a requests.Session, so that
+    consecutive requests reuse keep-alive connections instead of doing a
+    TCP/TLS handshake each time.
+
+    Requests are paced by the ratelimit.HostLimiter of the host and
+    transient failures are retried.
+    """
+
+    def __init__(self, base_url, metadata_registry=None, credentials=None,
+                 force_http_get=False, pool_size=10, timeout=60,
+                 rate_limit=0, max_concurrency=8, max_retries=5, cache=None):
+        BaseClient.__init__(self, metadata_registry)
+        self._base_url = base_url
+        self._local_file = False
+        self._force_http_get = force_http_get
+        self._credentials = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # replay.ResponseCache to record the responses in, or replay them from
+        self.cache = cache
+        self.limiter = get_limiter(
+            urlparse(base_url).netloc, rate_limit, max_concurrency
+        )
+        self.session = requests.Session()
+        self.session.auth = credentials
+        self.session.headers["User-Agent"] = "pyoai"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def makeRequest(self, **kw):
+        if self.cache is not None and self.cache.replay:
+            return self.cache.read(self._base_url, kw)
+        content = self._send(kw).content
+        if self.cache is not None:
+            self.cache.write(self._base_url, kw, content)
+        return content
+
+    def openRequest(self, **kw):
+        """
+        :returns: the response, with its body not read yet
+        """
+        return self._send(kw, stream=True)
+
+    def listPage(self, verb, metadata_prefix=None, **kw):
+        """
+        Request one ListIdentifiers/ListRecords page; its items are parsed
+        while the response is being received, see iter_page()
+        """
+        request = dict(kw, verb=verb)
+        if self.cache is not None and self.cache.replay:
+            source = self.cache.open(self._base_url, request)
+            return Page(self._iter_source(source, verb, metadata_prefix, kw))
+        response = self.openRequest(**request)
+        response.raw.decode_content = True
+        source = response.raw
+        if self.cache is not None:
+            source = self.cache.recorder(self._base_url, request, source)
+        return Page(self._iter_source(
+            source, verb, metadata_prefix, kw, response
+        ))
+
+    def _iter_source(self, source, verb, metadata_prefix, kw, response=None):
+        try:
+            token = yield from iter_page(
+                source, verb, metadata_prefix, self.getMetadataRegistry()
+            )
+        except etree.XMLSyntaxError:
+            raise error.XMLSyntaxError(kw)
+        except error.ErrorBase:
+            # read to the end, so that OAI-PMH errors like noRecordsMatch
+            # are recorded and replayed as well
+            while source.read(65536):
+                pass
+            raise
+        finally:
+            source.close()
+            if response is not None:
+                response.close()
+        return token
+
+    def _send(self, kw, stream=False):
+        """
+        Send a request through the limiter of the host, retrying connection
+        errors, timeouts, 429 and 5xx responses up to max_retries times with
+        exponential backoff, or as long as the Retry-After header says
+        """
+        for attempt in range(self.max_retries + 1):
+            response = None
+            failure = None
+            throttled = False
+            retry_after = None
+            self.limiter.acquire()
+            try:
+                if self._force_http_get:
+                    response = self.session.get(
+                        self._base_url, params=kw, timeout=self.timeout, stream=stream
+                    )
+                else:
+                    response = self.session.post(
+                        self._base_url, data=kw, timeout=self.timeout, stream=stream
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                failure = e
+            else:
+                if response.status_code in THROTTLE_STATUS:
+                    throttled = True
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                elif response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+            finally:
+                self.limiter.release(throttled, retry_after)
+
+            if attempt == self.max_retries:
+                break
+            log.info(
+                "Request %s to %s failed (%s), retry %s of %s"
+                % (kw, self._base_url, failure or response.status_code,
+                   attempt + 1, self.max_retries)
+            )
+            if response is not None:
+                response.close()
+            if retry_after is None:
+                time.sleep(backoff_delay(attempt))
+            # else the limiter pauses until the Retry-After
+
+        if failure is not None:
+            raise failure
+        response.raise_for_status()
+        return response
+
+
+class Page(object):
+    """
+    Items of one ListIdentifiers/ListRecords response, read while iterating.
+
+    The resumptionToken comes last in a response, so ``token`` is only set
+    once all items were read. ``error`` is set if the page ended early
+    because reading it failed in another thread (see
+    partitions.list_partitions).
+    """
+
+    def __init__(self, items):
+        """
+        :param items: generator of the items, returning the token
+        """
+        self._items = items
+        self.token = None
+        self.error = None
+        self._read = False
+
+    def __iter__(self):
+        if self._read:
+            raise RuntimeError("Page was read already")
+        self._read = True
+        self.token = yield from self._items
+        return self.token
+
+    def read(self):
+        """
+        Read the rest of the page, to get its token
+        """
+        if not self._read:
+            for _ in self:
+                pass
+        return self.token
+
+
+def iter_page(source, verb, metadata_prefix=None, metadata_registry=None):
+    """
+    Read a ListIdentifiers/ListRecords response with iterparse instead of
+    building the tree of the whole page: every header or record is turned
+    into pyoai objects as soon as its end tag is read, and its elements are
+    released right after, so memory does not grow with the page size.
+
+    :param source: file-like object with the response body
+    :returns: generator of headers or (header, metadata, None) tuples like
+        Client.buildIdentifiers/buildRecords, returning the resumptionToken
+    """
+    item_tag = _RECORD if verb == "ListRecords" else _HEADER
+    token = None
+    for _, element in etree.iterparse(
+            source, events=("end",), tag=(item_tag, _TOKEN, _ERROR), huge_tree=True
+    ):
+        if element.tag == _ERROR:
+            _raise_error(element.get("code"), element.text)
+        elif element.tag == _TOKEN:
+            token = (element.text or "").strip() or None
+        elif item_tag == _HEADER:
+            yield buildHeader(element, OAI_NAMESPACES)
+        else:
+            header = buildHeader(element.find(_HEADER), OAI_NAMESPACES)
+            metadata_element = element.find(_METADATA)
+            metadata = None
+            if metadata_element is not None:
+                metadata = metadata_registry.readMetadata(
+                    metadata_prefix, metadata_element
+                )
+            yield header, metadata, None
+        # the readers copied what they need
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return token
+
+
+def _raise_error(code, msg):
+    """
+    Raise the pyoai exception of an OAI-PMH error code, as
+    BaseClient.makeRequestErrorHandling does
+    """
+    if code not in _ERROR_CODES:
+        raise error.UnknownError(
+            "Unknown error code from server: %s, message: %s" % (code, msg)
+        )
+    raise getattr(error, code[0].upper() + code[1:] + "Error")(msg)
+
+
+def get_client(base_url, credentials=None, force_http_get=False,
+               rate_limit=0, max_concurrency=8, max_retries=5, cache=None):
+    """
+    Client of this worker for an OAI-PMH endpoint, created on first use
+    with the shared metadata registry
+
+    :param rate_limit: requests per second to the host, 0 for no limit
+    :param max_concurrency: most requests in flight to the host
+    :param max_retries: retries of a failed request
+    :param cache: replay.ResponseCache, if responses are recorded or replayed
+    """
+    key = (
+        base_url, credentials, force_http_get, rate_limit, max_concurrency,
+        max_retries, cache and (cache.directory, cache.mode),
+    )
+    client = _clients.get(key)
+    if client is None:
+        client = SessionClient(
+            base_url,
+            metadata_registry,
+            credentials,
+            force_http_get=force_http_get,
+            rate_limit=rate_limit,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+            cache=cache,
+        )
+        _clients.set(key, client)
+    return client
+
+
+def list_pages(client, verb, resumption_token=None, **kw):
+    """
+    Walk a ListIdentifiers/ListRecords response one page at a time.
+
+    pyoai keeps the resumptionToken inside its own generators, so the
+    requests are made here to be able to checkpoint the token after
+    every page.
+
+    :param client: oaipmh.client.Client
+    :param verb: "ListIdentifiers" or "ListRecords"
+    :param resumption_token: token of the page to continue from
+    :param kw: OAI-PMH arguments of the first request (metadataPrefix,
+        set, from, until), None values are dropped
+    :returns: generator of Page objects, whose token is the one of the
+        *next* page (None after the last page)
+    """
+    kw = dict((key, value) for key, value in kw.items() if value is not None)
+    metadata_prefix = kw.get("metadataPrefix")
+    token = resumption_token
+    while True:
+        try:
+            if token:
+                page = _list_page(
+                    client, verb, metadata_prefix, resumptionToken=token
+                )
+            else:
+                page = _list_page(client, verb, metadata_prefix, **kw)
+            # errors of the repository come with the first item
+            page = _prefetch(page)
+        except BadResumptionTokenError:
+            if token != resumption_token:
+                raise
+            # the repository forgot the saved token, start over
+            log.warning(
+                "Resumption token %s expired, restarting %s" % (token, verb)
+            )
+            resumption_token = token = None
+            continue
+        except NoRecordsMatchError:
+            return
+        yield page
+        token = page.read()
+        if token is None:
+            return
+
+
+def list_set_specs(client):
+    """
+    setSpecs of the top-level sets of a repository. A record of a set A:B
+    belongs to A as well, so the subsets are left out.
+
+    :returns: list of setSpecs, [None] if the repository has no sets
+    """
+    try:
+        specs = [spec for spec, _, _ in client.listSets()]
+    except NoSetHierarchyError:
+        return [None]
+    known = set(specs)
+    top_level = []
+    for spec in specs:
+        parts = spec.split(":")
+        if not any(":".join(parts[:i]) in known for i in range(1, len(parts))):
+            top_level.append(spec)
+    return top_level or [None]
+
+
+def _prefetch(page):
+    """
+    Read the first item of a page, so that OAI-PMH errors of the request
+    are raised here rather than while the caller iterates the page
+    """
+    items = iter(page)
+    try:
+        first = next(items)
+    except StopIteration as stop:
+        return Page(_items_and_token((), stop.value))
+    return Page(_chain_first(first, items))
+
+
+def _chain_first(first, items):
+    yield first
+    return (yield from items)
+
+
+def _items_and_token(items, token):
+    yield from items
+    return token
+
+
+def _list_page(client, verb, metadata_prefix, **kw):
+    """
+    One page of a list request, streamed by clients that support it
+    (SessionClient), parsed by pyoai otherwise
+    """
+    if hasattr(client, "listPage"):
+        return client.listPage(verb, metadata_prefix, **kw)
+    tree = client.makeRequestErrorHandling(verb=verb, **kw)
+    if verb == "ListRecords":
+        items, token = client.buildRecords(
+            metadata_prefix,
+            client.getNamespaces(),
+            client.getMetadataRegistry(),
+            tree,
+        )
+    else:
+        items, token = client.buildIdentifiers(client.getNamespaces(), tree)
+    return Page(_items_and_token(items, token))
@@ -0,0 +1,165 @@
+"""
+Parallel gather: the ListIdentifiers/ListRecords walk of a job split into
+partitions, by OAI set and/or by date window, which are listed
+concurrently.
+
+Every partition is its own list_pages() walk with its own resumptionToken,
+so that one slow partition does not hold up the others and an
+interrupted gather resumes each partition where it stopped (see
+model.GatherPartition).
+"""
+import logging
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+
+from ckanext.massbankharvester.harvester.oai import Page
+
+log = logging.getLogger(__name__)
+
+DATESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class _Stopped(Exception):
+    pass
+
+
+def date_windows(start, end, days):
+    """
+    Split the OAI-PMH range start..end (datestamps, both inclusive) into
+    consecutive windows of the given number of days
+
+    :returns: list of (from, until) datestamps
+    """
+    start = datetime.strptime(start, DATESTAMP_FORMAT)
+    end = datetime.strptime(end, DATESTAMP_FORMAT)
+    windows = []
+    while True:
+        stop = start + timedelta(days=days)
+        if stop > end:
+            windows.append((start, end))
+            break
+        # "until" is inclusive, the next window starts one second later
+        windows.append((start, stop - timedelta(seconds=1)))
+        start = stop
+    return [
+        (window_start.strftime(DATESTAMP_FORMAT), window_end.strftime(DATESTAMP_FORMAT))
+        for window_start, window_end in windows
+    ]
+
+
+def plan_partitions(set_specs, start, end, window_days=None):
+    """
+    :param set_specs: sets to list, [None] for the whole repository
+    :param window_days: length of the date windows, None for a single one
+    :returns: list of (set_spec, from, until)
+    """
+    windows = [(start, end)]
+    if window_days:
+        windows = date_windows(start, end, window_days)
+    return [
+        (set_spec, window_start, window_end)
+        for set_spec in set_specs
+        for window_start, window_end in windows
+    ]
+
+
+def list_partitions(partitions, list_pages, concurrency, chunk_size=100):
+    """
+    List partitions with up to concurrency threads. A page is handed over
+    through a bounded queue as soon as its response arrives, and its items
+    follow in chunks of chunk_size while the thread is still parsing it, so
+    a thread holds a few chunks instead of whole pages, and a slow consumer
+    holds the threads back instead of piling up items.
+
+    :param partitions: list of partitions, passed to list_pages
+    :param list_pages: function(partition) -> generator of oai.Page
+    :returns: generator of (partition, page) in the order the pages arrive,
+        the pages of each partition in order. The end of a partition is
+        (partition, None), or (partition, exception) if listing it failed.
+        A page that failed while its items were read ends early, with the
+        exception as its ``error``.
+    """
+    pages = queue.Queue(maxsize=2 * concurrency)
+    stop = threading.Event()
+
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def walk(partition):
+        if stop.is_set():
+            return
+        chunks, chunk = None, []
+        try:
+            for page in list_pages(partition):
+                chunks = queue.Queue(maxsize=2)
+                put(pages, (partition, _HandedOverPage(chunks)))
+                chunk = []
+                for item in page:
+                    chunk.append(item)
+                    if len(chunk) >= chunk_size:
+                        put(chunks, chunk)
+                        chunk = []
+                put(chunks, chunk)
+                put(chunks, _PageEnd(page.token, None))
+                chunks = None
+        except _Stopped:
+            return
+        except Exception as e:
+            log.debug("Listing partition %s failed: %r" % (partition, e))
+            try:
+                if chunks is not None:
+                    put(chunks, chunk)
+                    put(chunks, _PageEnd(None, e))
+                put(pages, (partition, e))
+            except _Stopped:
+                return
+        else:
+            try:
+                put(pages, (partition, None))
+            except _Stopped:
+                return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for partition in partitions:
+            executor.submit(walk, partition)
+        remaining = len(partitions)
+        while remaining:
+            partition, page = pages.get()
+            if page is None or isinstance(page, Exception):
+                remaining -= 1
+            yield partition, page
+    finally:
+        # let the threads go if the consumer stopped early
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+_PageEnd = namedtuple("_PageEnd", ["token", "error"])
+
+
+class _HandedOverPage(Page):
+    """
+    Page whose items are read by a listing thread and handed over in chunks
+    """
+
+    def __init__(self, chunks):
+        Page.__init__(self, self._receive(chunks))
+
+    def _receive(self, chunks):
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, _PageEnd):
+                self.error = chunk.error
+                return chunk.token
+            yield from chunk
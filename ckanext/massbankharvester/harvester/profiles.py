@@ -0,0 +1,88 @@
+"""
+Mapping profiles of the harvested repositories, see mapping.py. A harvest
+source selects one with {"mapping": "<name>"}, or declares its own there.
+"""
+
+_DATES = {
+    "datePublished": {"path": "datePublished", "convert": "datetime"},
+    "dateCreated": {"path": "dateCreated", "convert": "datetime"},
+    "dateModified": {"path": "dateModified", "convert": "datetime"},
+}
+
+# one flat JSON-LD Dataset per record
+MASSBANK = {
+    "package": {
+        "title": {"path": "name", "required": True},
+        "notes": {"path": "description", "required": True},
+        "maintainer": {"path": "publisher", "convert": "first"},
+        "url": {"path": "url", "required": True},
+    },
+    "resources": [
+        {
+            "name": {"path": "name", "required": True},
+            "resource_type": {"path": "format", "convert": "first", "default": "HTML"},
+            "format": {"path": "format", "convert": "first", "default": "HTML"},
+            "url": "url",
+        },
+    ],
+    "extras": dict({
+        "inchi": {"path": "inChI", "required": True},
+        "inchi_key": {"path": "inchikey", "required": True},
+        "smiles": {"path": "smiles", "required": True},
+        "exactmass": {"path": "monoisotopicMolecularWeight", "required": True},
+    }, **_DATES),
+    "molecule": {"inchi": "inChI", "inchi_key": "inchikey"},
+    "chemistry": {
+        "inchi": {"path": "inChI", "required": True},
+        "smiles": {"path": "smiles", "required": True},
+        "inchi_key": {"path": "inchikey", "required": True},
+        "exact_mass": {"path": "monoisotopicMolecularWeight", "required": True},
+        "mol_formula": {"path": "molecularFormula", "required": True},
+        "alternate_names": {"path": "alternateName", "convert": "list", "required": True},
+    },
+}
+
+# [dataset, study] per record, the molecules are parts of the studied sample
+_STUDY = "1."
+_SAMPLE = "1.about."
+_MOLECULE = "1.about.hasBioChemEntityPart.0."
+
+NMRXIV = {
+    "package": {
+        "title": {"path": _STUDY + "name", "required": True},
+        "notes": [_MOLECULE + "description", _STUDY + "description"],
+        "maintainer": _STUDY + "publisher",
+        "url": {"path": _STUDY + "url", "required": True},
+        "author": {"path": _STUDY + "isPartOf.citation.author", "convert": "join"},
+    },
+    "resources": [
+        {
+            "name": {"path": _SAMPLE + "name", "required": True},
+            "resource_type": {"path": _SAMPLE + "format", "convert": "first", "default": "HTML"},
+            "format": {"path": _SAMPLE + "format", "convert": "first", "default": "HTML"},
+            "url": {"path": _SAMPLE + "url", "required": True},
+        },
+    ],
+    "extras": dict({
+        "inchi": {"path": _MOLECULE + "inChI", "required": True},
+        "inchi_key": {"path": _MOLECULE + "inChIKey", "required": True},
+        "smiles": {"path": _MOLECULE + "smiles.2", "required": True},
+        "mol_formula": {"path": _MOLECULE + "molecularFormula", "required": True},
+        "exactmass": {"molecule": "mol_weight"},
+    }, **{
+        key: dict(spec, path=_STUDY + spec["path"]) for key, spec in _DATES.items()
+    }),
+    "molecule": {"inchi": _MOLECULE + "inChI", "inchi_key": _MOLECULE + "inChIKey"},
+    "chemistry": {
+        "inchi": {"path": _MOLECULE + "inChI", "required": True},
+        "smiles": {"path": _MOLECULE + "smiles.2", "required": True},
+        "inchi_key": {"path": _MOLECULE + "inChIKey", "required": True},
+        "exact_mass": {"molecule": "exact_mass"},
+        "mol_formula": {"path": _MOLECULE + "molecularFormula", "required": True},
+    },
+}
+
+PROFILES = {
+    "massbank": MASSBANK,
+    "nmrxiv": NMRXIV,
+}
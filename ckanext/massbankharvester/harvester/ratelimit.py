@@ -0,0 +1,129 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 600
+
+# host -> HostLimiter shared by the clients of this worker
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class HostLimiter(object):
+    """
+    Token bucket with an adaptive concurrency limit for the requests to
+    one host.
+
+    Requests start once a token is available (``rate`` per second, no rate
+    limit if 0) and fewer than ``concurrency`` requests are in flight. The
+    concurrency limit is halved whenever the host answers 429/503, and
+    grows back by one request per window of successful ones (AIMD, as in
+    TCP congestion control), so it settles at what the server can take. A
+    Retry-After pauses all requests to the host.
+    """
+
+    def __init__(self, rate=0, max_concurrency=8):
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._updated = time.monotonic()
+        self.concurrency = float(max_concurrency)
+        self.configure(rate, max_concurrency)
+        self._tokens = self._burst
+
+    def configure(self, rate, max_concurrency):
+        with self._cond:
+            self.rate = float(rate or 0)
+            self._burst = max(1.0, self.rate)
+            self.max_concurrency = max_concurrency
+            self.concurrency = min(self.concurrency, float(max_concurrency))
+            self._cond.notify_all()
+
+    def acquire(self):
+        """
+        Wait until a request may be sent
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.rate:
+                    self._tokens = min(
+                        self._burst, self._tokens + (now - self._updated) * self.rate
+                    )
+                self._updated = now
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self._in_flight >= max(1, int(self.concurrency)):
+                    self._cond.wait()
+                elif self.rate and self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self.rate)
+                else:
+                    break
+            if self.rate:
+                self._tokens -= 1
+            self._in_flight += 1
+
+    def release(self, throttled=False, retry_after=None):
+        """
+        :param throttled: whether the host answered 429 or 503
+        :param retry_after: seconds to pause all requests to the host
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                log.info("Throttled, concurrency lowered to %d" % self.concurrency)
+            else:
+                self.concurrency = min(
+                    float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency
+                )
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+
+def get_limiter(host, rate=0, max_concurrency=8):
+    """
+    Limiter of this worker for a host, shared by all its clients
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(rate, max_concurrency)
+        elif (limiter.rate, limiter.max_concurrency) != (float(rate or 0), max_concurrency):
+            limiter.configure(rate, max_concurrency)
+    return limiter
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header (delay-seconds or HTTP-date),
+    None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            date = None
+        if date is None:
+            return None
+        seconds = date.timestamp() - time.time()
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt, base=1.0, maximum=60.0):
+    """
+    Exponential backoff with jitter: up to base * 2**attempt seconds,
+    bounded by maximum
+    """
+    delay = min(maximum, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import tempfile
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+import ckan.plugins.toolkit as toolkit
+
+log = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+
+# mode -> ResponseCache of this worker
+_caches = {}
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache(object):
+    """
+    OAI-PMH response bodies on disk, keyed by the base URL and the request
+    arguments.
+
+    In "record" mode SessionClient stores every response it receives, in
+    "replay" mode it serves all requests from the stored responses without
+    touching the network, and raises CacheMiss for the others.
+    """
+
+    def __init__(self, directory, mode):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Unknown HTTP cache mode %r" % mode)
+        self.directory = directory
+        self.mode = mode
+
+    @property
+    def replay(self):
+        return self.mode == REPLAY
+
+    def path(self, base_url, kw):
+        request = base_url + "?" + urlencode(sorted(kw.items()))
+        digest = hashlib.sha256(request.encode("utf-8")).hexdigest()
+        return os.path.join(
+            self.directory,
+            urlparse(base_url).netloc,
+            kw.get("verb", "unknown"),
+            digest[:2],
+            digest + ".xml",
+        )
+
+    def open(self, base_url, kw):
+        """
+        :returns: the stored response as a binary file
+        :raises CacheMiss: if the request was not recorded
+        """
+        try:
+            return open(self.path(base_url, kw), "rb")
+        except FileNotFoundError:
+            raise CacheMiss("No recorded response for %s %s" % (base_url, kw))
+
+    def read(self, base_url, kw):
+        with self.open(base_url, kw) as f:
+            return f.read()
+
+    def write(self, base_url, kw, content):
+        recorder = self.recorder(base_url, kw, None)
+        recorder.write(content)
+        recorder.commit()
+
+    def recorder(self, base_url, kw, source):
+        """
+        File-like object reading from source and storing all it reads under
+        the key of the request once the end of source was reached
+        """
+        return _Recorder(self.path(base_url, kw), source)
+
+
+class _Recorder(object):
+    """
+    Stores the response in a temporary file next to its final path, renamed
+    into place when complete, so that replays never read partial responses
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.complete = False
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.write(data)
+        else:
+            self.complete = True
+        return data
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.complete:
+            self.commit()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+def get_http_cache_dir():
+    return toolkit.config.get(
+        "ckanext.massbankharvester.http_cache_dir",
+        os.path.join(
+            toolkit.config.get("ckan.storage_path") or tempfile.gettempdir(),
+            "massbankharvester",
+            "http_cache",
+        ),
+    )
+
+
+def get_response_cache(mode):
+    """
+    ResponseCache of this worker for a mode of the "http_cache" source
+    option, None if it is not set
+    """
+    if not mode:
+        return None
+    cache = _caches.get(mode)
+    if cache is None:
+        cache = _caches[mode] = ResponseCache(get_http_cache_dir(), mode)
+    return cache
@@ -0,0 +1,314 @@
+import io
+import logging
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+
+import ckan.plugins.toolkit as toolkit
+from ckan.model import Session
+from ckan.model.package_extra import PackageExtra
+from sqlalchemy import text
+from sqlalchemy.orm import aliased
+
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.db import get_engine
+from ckanext.massbankharvester.model import ImageQueueItem
+
+log = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_DIR = "/var/lib/ckan/default/storage/images"
+
+IMAGE_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+# width and height in pixels, the smaller one is the thumbnail
+IMAGE_SIZES = (300, 120)
+DEFAULT_FORMAT = "png"
+DEFAULT_SIZE = 300
+TMP_SUFFIX = ".tmp"
+
+# seconds an unknown InChIKey is not looked up again
+MISS_TTL = 300
+
+# bytes rendered by this process since the image directory was last trimmed
+_rendered_bytes = 0
+# InChIKey -> time of the lookup that did not find it
+_misses = LRUCache(maxsize=10000)
+
+
+def get_image_dir():
+    return toolkit.config.get(
+        "ckanext.massbankharvester.image_dir", DEFAULT_IMAGE_DIR
+    )
+
+
+def image_path(inchi_key, image_dir=None, fmt=DEFAULT_FORMAT, size=DEFAULT_SIZE):
+    """
+    Path of an image in the store, sharded by the first two pairs of
+    letters of the InChIKey: <image_dir>/AB/CD/ABCD...[_<size>].<fmt>
+
+    Images of the default size have no size suffix.
+    """
+    inchi_key = str(inchi_key)
+    name = inchi_key
+    if size != DEFAULT_SIZE:
+        name += "_%d" % size
+    return os.path.join(
+        image_dir or get_image_dir(),
+        inchi_key[0:2],
+        inchi_key[2:4],
+        "%s.%s" % (name, fmt),
+    )
+
+
+def write_atomic(filepath, data):
+    """
+    Write data through a temporary file in the same directory, renamed into
+    place, so that readers never see a partial image
+    """
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=TMP_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def get_image_cache_size():
+    """
+    Size limit of the image directory in bytes, 0 for no limit
+    """
+    return int(toolkit.config.get(
+        "ckanext.massbankharvester.image_cache_size", 1024)) * 1024 * 1024
+
+
+def draw_molecule(molecule, fmt=DEFAULT_FORMAT, size=DEFAULT_SIZE):
+    """
+    :returns: the image of an RDKit molecule as bytes
+    """
+    from rdkit.Chem import Draw
+    from rdkit.Chem.Draw import rdMolDraw2D
+
+    if fmt == "svg":
+        drawer = rdMolDraw2D.MolDraw2DSVG(size, size)
+        drawer.DrawMolecule(molecule)
+        drawer.FinishDrawing()
+        return drawer.GetDrawingText().encode("utf-8")
+    buf = io.BytesIO()
+    Draw.MolToImage(molecule, size=(size, size)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def render_image(args):
+    """
+    Draw the structure image of one molecule, runs in a worker process
+
+    :param args: (inchi_key, inchi, image_dir, fmt, size) tuple
+    :returns: (inchi_key, error message or None)
+    """
+    inchi_key, standard_inchi, image_dir, fmt, size = args
+    # RDKit is only needed by the worker processes
+    from rdkit.Chem import inchi
+
+    try:
+        filepath = image_path(inchi_key, image_dir, fmt, size)
+        if not os.path.isfile(filepath):
+            molecule = inchi.MolFromInchi(standard_inchi)
+            if molecule is None:
+                return inchi_key, "Invalid InChI %s" % standard_inchi
+            write_atomic(filepath, draw_molecule(molecule, fmt, size))
+    except Exception as e:
+        return inchi_key, str(e)
+    return inchi_key, None
+
+
+def drain_queue(processes=None, batch_size=500):
+    """
+    Render the images of all queued molecules with a pool of worker
+    processes (one per core by default).
+
+    Rendered molecules leave the queue, failed ones stay with their error.
+
+    :returns: (rendered, failed) counts
+    """
+    image_dir = get_image_dir()
+    rendered = failed = 0
+    with Pool(processes) as pool:
+        while True:
+            items = ImageQueueItem.pending(batch_size)
+            if not items:
+                break
+            by_key = dict((item.inchi_key, item) for item in items)
+            jobs = [
+                (item.inchi_key, item.inchi, image_dir, DEFAULT_FORMAT, DEFAULT_SIZE)
+                for item in items
+            ]
+            for inchi_key, error in pool.imap_unordered(render_image, jobs, chunksize=16):
+                item = by_key[inchi_key]
+                if error:
+                    log.error("Rendering %s failed: %s" % (inchi_key, error))
+                    item.error = error
+                    failed += 1
+                else:
+                    Session.delete(item)
+                    rendered += 1
+            Session.commit()
+            log.info("%s images rendered, %s failed" % (rendered, failed))
+    return rendered, failed
+
+
+def backfill_queue():
+    """
+    Queue every harvested molecule whose image file is missing
+
+    :returns: number of queued molecules
+    """
+    image_dir = get_image_dir()
+    inchi_extra = aliased(PackageExtra)
+    inchi_key_extra = aliased(PackageExtra)
+    query = Session.query(
+        inchi_key_extra.value, inchi_extra.value
+    ).join(
+        inchi_extra, inchi_extra.package_id == inchi_key_extra.package_id
+    ).filter(
+        inchi_key_extra.key == "inchi_key",
+        inchi_extra.key == "inchi",
+    ).distinct()
+
+    queued = 0
+    for inchi_key, standard_inchi in query:
+        if not standard_inchi.startswith("InChI"):
+            continue
+        if os.path.isfile(image_path(inchi_key, image_dir)):
+            continue
+        ImageQueueItem.enqueue(inchi_key, standard_inchi)
+        queued += 1
+    Session.commit()
+    return queued
+
+
+def find_inchi(inchi_key):
+    """
+    InChI of a harvested molecule, None if no package has this InChIKey.
+
+    The package is found by the indexed molecule_data.inchi_key, and
+    unknown InChIKeys are remembered for MISS_TTL seconds, so that requests
+    for random keys cost no more than a cache lookup.
+    """
+    missed = _misses.get(inchi_key)
+    if missed is not None and time.time() - missed < MISS_TTL:
+        return None
+    with get_engine().connect() as connection:
+        package_id = connection.execute(
+            text("SELECT package_id FROM molecule_data WHERE inchi_key = :inchi_key LIMIT 1"),
+            inchi_key=inchi_key,
+        ).scalar()
+    standard_inchi = None
+    if package_id is not None:
+        standard_inchi = Session.query(PackageExtra.value).filter(
+            PackageExtra.package_id == package_id,
+            PackageExtra.key == "inchi",
+        ).limit(1).scalar()
+    if standard_inchi is None:
+        _misses.set(inchi_key, time.time())
+    return standard_inchi
+
+
+def get_or_render_image(inchi_key, fmt=DEFAULT_FORMAT, size=DEFAULT_SIZE):
+    """
+    Path of the structure image of a harvested molecule, rendered from its
+    stored InChI on the first request.
+
+    :returns: the path, None if the molecule is unknown or can't be drawn
+    """
+    global _rendered_bytes
+    image_dir = get_image_dir()
+    filepath = image_path(inchi_key, image_dir, fmt, size)
+    if os.path.isfile(filepath):
+        # keeps recently served images from being evicted
+        os.utime(filepath, None)
+        return filepath
+
+    standard_inchi = find_inchi(inchi_key)
+    if not standard_inchi or not standard_inchi.startswith("InChI"):
+        return None
+    inchi_key, error = render_image((inchi_key, standard_inchi, image_dir, fmt, size))
+    if error:
+        log.error("Rendering %s failed: %s" % (inchi_key, error))
+        return None
+
+    max_bytes = get_image_cache_size()
+    if max_bytes:
+        _rendered_bytes += os.path.getsize(filepath)
+        # scanning the directory is costly, so trim it only after 5% of
+        # the limit was written
+        if _rendered_bytes >= max_bytes // 20:
+            evict_images(image_dir, max_bytes)
+            _rendered_bytes = 0
+    return filepath
+
+
+def _image_files(image_dir):
+    for directory, _, filenames in os.walk(image_dir):
+        for filename in filenames:
+            if filename.endswith(TMP_SUFFIX):
+                continue
+            yield os.path.join(directory, filename)
+
+
+def evict_images(image_dir, max_bytes):
+    """
+    Delete the least recently used images until the directory is below
+    90% of max_bytes
+
+    :returns: number of deleted images
+    """
+    entries = []
+    total = 0
+    for path in _image_files(image_dir):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total <= max_bytes:
+        return 0
+
+    deleted = 0
+    target = max_bytes * 9 // 10
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # removed by another worker
+            continue
+        total -= size
+        deleted += 1
+    log.info("%s images evicted from %s" % (deleted, image_dir))
+    return deleted
+
+
+def migrate_flat_dir(image_dir=None):
+    """
+    Move the <inchi_key>.png images of the former flat layout into their
+    shard directories
+
+    :returns: number of moved images
+    """
+    image_dir = image_dir or get_image_dir()
+    moved = 0
+    for entry in os.scandir(image_dir):
+        name, ext = os.path.splitext(entry.name)
+        if not entry.is_file() or ext[1:] not in IMAGE_FORMATS:
+            continue
+        target = image_path(name, image_dir, ext[1:])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(entry.path, target)
+        moved += 1
+    return moved
@@ -0,0 +1,123 @@
+import datetime
+import logging
+import time
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+
+import ckan.plugins.toolkit as toolkit
+from ckan.lib.search import commit
+from ckan.lib.search import rebuild
+from ckan.model import Package
+from ckan.model import Session
+
+from ckanext.massbankharvester.model import IndexQueueItem
+from ckanext.massbankharvester.model import index_queue_table
+
+log = logging.getLogger(__name__)
+
+_search_index_queue = None
+
+
+class SearchIndexQueue(object):
+    """
+    Packages imported with "index_mode": "batch" wait in the table
+    massbankharvester_index_queue to be indexed together with a single
+    Solr commit.
+
+    A worker indexes the queue once it queued batch_size packages or its
+    oldest one waited max_wait seconds. What is left is indexed when the
+    job is finished (see jobs.py) or by `massbankharvester index-queued`.
+    """
+
+    def __init__(self, batch_size=100, max_wait=60):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queued = 0
+        self._since = None
+
+    def add(self, package_id, harvest_job_id):
+        """
+        Queue a package in the session, to be committed along with it
+        """
+        Session.execute(insert(index_queue_table).values(
+            package_id=package_id,
+            harvest_job_id=harvest_job_id,
+            queued=datetime.datetime.utcnow(),
+        ).on_conflict_do_nothing())
+        if self._since is None:
+            self._since = time.time()
+        self._queued += 1
+
+    def due(self):
+        return self._queued >= self.batch_size or (
+            self._since is not None and time.time() - self._since >= self.max_wait
+        )
+
+    def index(self, harvest_job_id):
+        """
+        Index the queued packages of a job and all that waited max_wait
+        seconds
+        """
+        self._queued = 0
+        self._since = None
+        return index_queued(harvest_job_id, self.max_wait)
+
+
+def index_queued(harvest_job_id=None, max_wait=None):
+    """
+    Index queued packages with a single Solr commit: those of a job, those
+    that waited max_wait seconds, or all of them. Packages another process
+    is indexing are left to it.
+
+    :returns: the number of packages indexed
+    """
+    query = Session.query(IndexQueueItem)
+    conditions = []
+    if harvest_job_id is not None:
+        conditions.append(IndexQueueItem.harvest_job_id == harvest_job_id)
+    if max_wait is not None:
+        conditions.append(IndexQueueItem.queued <= (
+            datetime.datetime.utcnow() - datetime.timedelta(seconds=max_wait)
+        ))
+    if conditions:
+        query = query.filter(or_(*conditions))
+    items = query.with_for_update(skip_locked=True).all()
+    if not items:
+        Session.commit()
+        return 0
+
+    package_ids = [item.package_id for item in items]
+    try:
+        for item in items:
+            Session.delete(item)
+        Session.flush()
+        # packages purged since they were queued are gone from the index
+        package_ids = [
+            package_id for (package_id,)
+            in Session.query(Package.id).filter(Package.id.in_(package_ids))
+        ]
+        # rebuild commits the session, and with it the deleted rows
+        rebuild(package_ids=package_ids, defer_commit=True)
+        commit()
+        Session.commit()
+    except Exception:
+        Session.rollback()
+        raise
+    log.debug("Indexed %s packages" % len(package_ids))
+    return len(package_ids)
+
+
+def get_search_index_queue():
+    """
+    SearchIndexQueue of this process
+    """
+    global _search_index_queue
+    if _search_index_queue is None:
+        _search_index_queue = SearchIndexQueue(
+            batch_size=int(toolkit.config.get(
+                "ckanext.massbankharvester.index_batch_size", 100)),
+            max_wait=float(toolkit.config.get(
+                "ckanext.massbankharvester.index_max_wait", 60)),
+        )
+    return _search_index_queue
@@ -0,0 +1,53 @@
+"""
+What happens once a harvest job is finished. ckanext-harvest marks a job
+as "Finished" in its harvest_jobs_run action (`ckan harvester run`) when
+none of its objects are waiting any more; the chained action below then
+indexes the packages the job left queued, deletes its prefetch claims,
+logs the timings of the job and merges its profiles.
+"""
+import logging
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.massbankharvester.indexing import index_queued
+from ckanext.massbankharvester.metrics import log_job_summary
+from ckanext.massbankharvester.model import claim_finished_job
+from ckanext.massbankharvester.model import get_unhandled_finished_jobs
+from ckanext.massbankharvester.model import release_fetch_claims
+from ckanext.massbankharvester.profiling import merge_job_profiles
+
+log = logging.getLogger(__name__)
+
+
+def finish_jobs():
+    """
+    Handle the end of the finished jobs that were not handled yet. Each job
+    is claimed first, so concurrent runs handle it once.
+
+    :returns: the ids of the jobs handled
+    """
+    handled = []
+    for harvest_job in get_unhandled_finished_jobs():
+        if not claim_finished_job(harvest_job.id):
+            continue
+        try:
+            index_queued(harvest_job.id)
+        except Exception:
+            # left to the workers and to `massbankharvester index-queued`
+            log.exception("Indexing the packages of job %s failed" % harvest_job.id)
+        release_fetch_claims(harvest_job.id)
+        log_job_summary(harvest_job.id)
+        merge_job_profiles(harvest_job)
+        handled.append(harvest_job.id)
+    return handled
+
+
+@toolkit.chained_action
+def harvest_jobs_run(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    try:
+        finish_jobs()
+    except Exception:
+        # the jobs are finished for ckanext-harvest either way
+        log.exception("Handling the finished harvest jobs failed")
+    return result
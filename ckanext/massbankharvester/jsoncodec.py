@@ -0,0 +1,54 @@
+"""
+JSON parsing of the harvested records: orjson or ujson when installed,
+the standard library otherwise.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    backend = "orjson"
+    _loads = orjson.loads
+elif ujson is not None:
+    backend = "ujson"
+    _loads = ujson.loads
+else:
+    backend = "json"
+    _loads = json.loads
+
+
+def loads(text):
+    try:
+        return _loads(text)
+    except ValueError:
+        # the fast parsers reject some of what the standard library
+        # accepts, like NaN
+        return json.loads(text)
+
+
+def normalize_container(json_data):
+    """
+    Turn the text nodes of a jc:json container into the JSON string stored
+    as HarvestObject content.
+
+    Runs of spaces and line breaks are collapsed into one space, as the
+    harvesters always did, and the result is parsed once to validate it.
+    The normalized text itself is stored, so it is not serialized again.
+
+    :param json_data: list of text nodes
+    :returns: (text, parsed value)
+    :raises ValueError: if the container holds no valid JSON
+    """
+    # same as re.sub(r"[\n ]+", " ", text).strip(), without a regex match
+    # for every line of the pretty-printed JSON; the containers also hold
+    # raw line breaks inside of string values
+    words = "".join(json_data).replace("\n", " ").split(" ")
+    text = " ".join(filter(None, words)).strip()
+    return text, loads(text)
@@ -0,0 +1,304 @@
+"""
+Timings of the sub-steps of harvest jobs (OAI requests, JSON handling,
+molecule lookups, package writes, indexing, chemistry tables).
+
+Every worker process collects histograms per HarvestJob and step, and adds
+them to the massbankharvester_job_timing table every flush_interval
+seconds, so that the table holds the timings of all workers of a job.
+"""
+import atexit
+import datetime
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+import ckan.plugins.toolkit as toolkit
+from ckan.model import meta
+
+from ckanext.massbankharvester.model import job_timing_table
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds, plus one for +Inf
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+METRIC_NAME = "massbankharvester_step_seconds"
+
+# harvest job id -> JobTimings of this process
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+class Histogram(object):
+    """
+    Count of observations per bucket of BUCKETS, like a Prometheus histogram
+    (the counts are not cumulative here)
+    """
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts else [0] * (len(BUCKETS) + 1)
+        self.sum = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """
+        Estimate of the q-quantile (0 <= q <= 1), interpolated inside of
+        its bucket like Prometheus' histogram_quantile()
+        """
+        count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+class Stopwatch(object):
+    """
+    Adds up the time spent in ``with`` blocks or in producing the items of
+    iterate(), e.g. the OAI requests and parsing of a page, but not the
+    loop body handling its items
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed += time.perf_counter() - self._start
+
+    def iterate(self, iterable):
+        items = iter(iterable)
+        while True:
+            with self:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def reset(self):
+        """
+        :returns: the time added up so far
+        """
+        elapsed, self.elapsed = self.elapsed, 0.0
+        return elapsed
+
+
+class JobTimings(object):
+    """
+    Histograms of the steps of one HarvestJob in this process that were not
+    written to the database yet
+    """
+
+    def __init__(self, harvest_job_id, harvest_source_id, flush_interval=10):
+        self.harvest_job_id = harvest_job_id
+        self.harvest_source_id = harvest_source_id
+        self.flush_interval = flush_interval
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    @contextmanager
+    def time(self, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(step, time.perf_counter() - start)
+
+    def observe(self, step, seconds):
+        with self._lock:
+            histogram = self._histograms.get(step)
+            if histogram is None:
+                histogram = self._histograms[step] = Histogram()
+            histogram.observe(seconds)
+            due = time.monotonic() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            histograms = self._histograms
+            self._histograms = {}
+            self._flushed = time.monotonic()
+        if not histograms:
+            return
+        try:
+            add_job_timings(self.harvest_job_id, self.harvest_source_id, histograms)
+        except Exception:
+            # timings are not worth failing a harvest for
+            log.exception(
+                "Writing the timings of job %s failed" % self.harvest_job_id
+            )
+
+
+def add_job_timings(harvest_job_id, harvest_source_id, histograms):
+    """
+    Add histograms to the stored ones of a job, in a transaction of its own
+    so that the session of the harvester is left alone
+
+    :param histograms: dict of step -> Histogram
+    """
+    table = job_timing_table
+    with meta.engine.begin() as connection:
+        # in step order, so that concurrent workers lock the rows alike
+        for step in sorted(histograms):
+            key = (table.c.harvest_job_id == harvest_job_id) & (table.c.step == step)
+            connection.execute(insert(table).values(
+                harvest_job_id=harvest_job_id,
+                step=step,
+                harvest_source_id=harvest_source_id,
+                buckets=json.dumps(Histogram().counts),
+                sum=0.0,
+            ).on_conflict_do_nothing())
+            row = connection.execute(
+                select([table.c.buckets, table.c.sum]).where(key).with_for_update()
+            ).first()
+            histogram = Histogram(json.loads(row.buckets), row.sum)
+            histogram.merge(histograms[step])
+            connection.execute(table.update().where(key).values(
+                buckets=json.dumps(histogram.counts),
+                sum=histogram.sum,
+                count=histogram.count,
+                modified=datetime.datetime.utcnow(),
+            ))
+
+
+def get_job_timings(harvest_job_id, harvest_source_id):
+    """
+    JobTimings of this process for a job. A worker handles one job at a
+    time, so the timings of other jobs are written and dropped.
+    """
+    with _timings_lock:
+        timings = _timings.get(harvest_job_id)
+        if timings is not None:
+            return timings
+        previous = list(_timings.values())
+        _timings.clear()
+        timings = _timings[harvest_job_id] = JobTimings(
+            harvest_job_id,
+            harvest_source_id,
+            flush_interval=float(toolkit.config.get(
+                "ckanext.massbankharvester.metrics_flush_interval", 10)),
+        )
+    for other in previous:
+        other.flush()
+    return timings
+
+
+def flush_all():
+    with _timings_lock:
+        timings = list(_timings.values())
+    for job_timings in timings:
+        job_timings.flush()
+
+
+atexit.register(flush_all)
+
+
+def read_job_timings(harvest_job_id=None, limit=None):
+    """
+    Stored histograms of one job, or of the limit most recently active jobs
+
+    :returns: list of (harvest_source_id, harvest_job_id, step, Histogram)
+    """
+    table = job_timing_table
+    query = select([
+        table.c.harvest_source_id, table.c.harvest_job_id, table.c.step,
+        table.c.buckets, table.c.sum,
+    ])
+    if harvest_job_id is not None:
+        query = query.where(table.c.harvest_job_id == harvest_job_id)
+    elif limit:
+        recent = select([table.c.harvest_job_id]).group_by(
+            table.c.harvest_job_id
+        ).order_by(func.max(table.c.modified).desc()).limit(limit)
+        query = query.where(table.c.harvest_job_id.in_(recent))
+    query = query.order_by(table.c.harvest_job_id, table.c.step)
+    with meta.engine.connect() as connection:
+        return [
+            (row.harvest_source_id, row.harvest_job_id, row.step,
+             Histogram(json.loads(row.buckets), row.sum))
+            for row in connection.execute(query)
+        ]
+
+
+def format_job_summary(harvest_job_id):
+    """
+    Table of the steps of a job with their count, total time and estimated
+    p50/p99 latency
+    """
+    lines = ["%-26s %8s %10s %10s %10s" % ("step", "count", "total s", "p50 ms", "p99 ms")]
+    for _, _, step, histogram in read_job_timings(harvest_job_id):
+        lines.append("%-26s %8d %10.2f %10.2f %10.2f" % (
+            step, histogram.count, histogram.sum,
+            histogram.quantile(0.5) * 1000, histogram.quantile(0.99) * 1000,
+        ))
+    return "\n".join(lines)
+
+
+def log_job_summary(harvest_job_id):
+    """
+    Write what this process still holds and log the summary of the job
+    """
+    timings = _timings.get(harvest_job_id)
+    if timings is not None:
+        timings.flush()
+    try:
+        log.info(
+            "Timings of harvest job %s:\n%s"
+            % (harvest_job_id, format_job_summary(harvest_job_id))
+        )
+    except Exception:
+        log.exception("Reading the timings of job %s failed" % harvest_job_id)
+
+
+def prometheus_text(limit=10):
+    """
+    The histograms of the limit most recently active jobs in the Prometheus
+    text exposition format
+    """
+    lines = [
+        "# HELP %s Time spent in the steps of harvest jobs." % METRIC_NAME,
+        "# TYPE %s histogram" % METRIC_NAME,
+    ]
+    for source_id, job_id, step, histogram in read_job_timings(limit=limit):
+        labels = 'source="%s",job="%s",step="%s"' % (source_id, job_id, step)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (METRIC_NAME, labels, bound, cumulative))
+        lines.append("%s_sum{%s} %s" % (METRIC_NAME, labels, repr(histogram.sum)))
+        lines.append("%s_count{%s} %d" % (METRIC_NAME, labels, cumulative))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,35 @@
+"""Add unique constraints for the chemistry table upserts
+
+Revision ID: 4f2c9e1b7a3d
+Revises:
+Create Date: 2026-10-18 10:12:31.402153
+
+"""
+from alembic import op
+
+from ckanext.massbankharvester import db
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2c9e1b7a3d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the chemistry tables may be in another database than the CKAN one
+    # this migration runs against, see db.get_engine()
+    if db.uses_own_engine():
+        with db.get_engine().begin() as connection:
+            db.add_unique_constraints(connection)
+    else:
+        db.add_unique_constraints(op.get_bind())
+
+
+def downgrade():
+    if db.uses_own_engine():
+        with db.get_engine().begin() as connection:
+            db.drop_unique_constraints(connection)
+    else:
+        db.drop_unique_constraints(op.get_bind())
@@ -0,0 +1,34 @@
+"""Add an index of molecule_data.inchi_key for the molecule image view
+
+Revision ID: 9b3d5e7a1c2f
+Revises: 4f2c9e1b7a3d
+Create Date: 2026-10-18 16:40:12.118204
+
+"""
+from alembic import op
+
+from ckanext.massbankharvester import db
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3d5e7a1c2f'
+down_revision = '4f2c9e1b7a3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the chemistry tables may be in another database, see db.get_engine()
+    if db.uses_own_engine():
+        with db.get_engine().begin() as connection:
+            db.add_inchi_key_index(connection)
+    else:
+        db.add_inchi_key_index(op.get_bind())
+
+
+def downgrade():
+    if db.uses_own_engine():
+        with db.get_engine().begin() as connection:
+            db.drop_inchi_key_index(connection)
+    else:
+        db.drop_inchi_key_index(op.get_bind())
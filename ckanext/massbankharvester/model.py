@@ -0,0 +1,427 @@
+import datetime
+import hashlib
+import json
+import logging
+
+from sqlalchemy import Column
+from sqlalchemy import Table
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import types
+from sqlalchemy.dialects.postgresql import insert
+
+from ckan.model import meta
+from ckan.model.meta import metadata, mapper, Session
+from ckan.model.domain_object import DomainObject
+from ckan.model.package_extra import PackageExtra
+from ckanext.harvest.model import HarvestJob
+from ckanext.harvest.model import HarvestObject
+
+log = logging.getLogger(__name__)
+
+CONTENT_HASH_KEY = "harvest_content_hash"
+
+gather_checkpoint_table = Table(
+    "massbankharvester_gather_checkpoint",
+    metadata,
+    Column("harvest_job_id", types.UnicodeText, primary_key=True),
+    Column("resumption_token", types.UnicodeText),
+    Column("object_count", types.Integer, default=0),
+    Column("finished", types.Boolean, default=False),
+    Column("modified", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+gather_partition_table = Table(
+    "massbankharvester_gather_partition",
+    metadata,
+    Column("harvest_job_id", types.UnicodeText, primary_key=True),
+    Column("partition", types.Integer, primary_key=True),
+    Column("set_spec", types.UnicodeText),
+    Column("from_datestamp", types.UnicodeText),
+    Column("until_datestamp", types.UnicodeText),
+    Column("resumption_token", types.UnicodeText),
+    Column("object_count", types.Integer, default=0),
+    Column("finished", types.Boolean, default=False),
+    Column("modified", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+image_queue_table = Table(
+    "massbankharvester_image_queue",
+    metadata,
+    Column("inchi_key", types.UnicodeText, primary_key=True),
+    Column("inchi", types.UnicodeText, nullable=False),
+    Column("queued", types.DateTime, default=datetime.datetime.utcnow),
+    Column("error", types.UnicodeText),
+)
+
+job_timing_table = Table(
+    "massbankharvester_job_timing",
+    metadata,
+    Column("harvest_job_id", types.UnicodeText, primary_key=True),
+    Column("step", types.UnicodeText, primary_key=True),
+    Column("harvest_source_id", types.UnicodeText, index=True),
+    # JSON list of the observations per bucket of metrics.BUCKETS
+    Column("buckets", types.UnicodeText, nullable=False),
+    Column("sum", types.Float, default=0.0),
+    Column("count", types.Integer, default=0),
+    Column("modified", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+index_queue_table = Table(
+    "massbankharvester_index_queue",
+    metadata,
+    Column("package_id", types.UnicodeText, primary_key=True),
+    Column("harvest_job_id", types.UnicodeText, index=True),
+    Column("queued", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+fetch_claim_table = Table(
+    "massbankharvester_fetch_claim",
+    metadata,
+    Column("harvest_object_id", types.UnicodeText, primary_key=True),
+    Column("harvest_job_id", types.UnicodeText, index=True),
+    Column("claimed", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+finished_job_table = Table(
+    "massbankharvester_finished_job",
+    metadata,
+    Column("harvest_job_id", types.UnicodeText, primary_key=True),
+    Column("finished", types.DateTime, default=datetime.datetime.utcnow),
+)
+
+
+class GatherCheckpoint(DomainObject):
+    """
+    Progress of the gather stage of one HarvestJob: the resumptionToken
+    of the next OAI-PMH page and the number of HarvestObjects created so far
+    """
+
+    @classmethod
+    def get(cls, harvest_job_id):
+        return Session.query(cls).filter(
+            cls.harvest_job_id == harvest_job_id
+        ).first()
+
+    @classmethod
+    def get_or_create(cls, harvest_job_id):
+        checkpoint = cls.get(harvest_job_id)
+        if checkpoint is None:
+            checkpoint = cls(
+                harvest_job_id=harvest_job_id, object_count=0, finished=False
+            )
+        return checkpoint
+
+    def update(self, resumption_token, object_count):
+        """
+        Add the new state to the session, to be committed together with
+        the HarvestObjects it accounts for
+        """
+        self.resumption_token = resumption_token
+        self.object_count = object_count
+        self.finished = resumption_token is None
+        self.modified = datetime.datetime.utcnow()
+        self.add()
+
+
+mapper(GatherCheckpoint, gather_checkpoint_table)
+
+
+class GatherPartition(DomainObject):
+    """
+    Progress of one partition (OAI set and date window) of a partitioned
+    gather stage, see harvester/partitions.py. The partitions of a job are
+    stored when its gather starts, so that a resumed gather lists the same
+    ones.
+    """
+
+    @classmethod
+    def for_job(cls, harvest_job_id):
+        return Session.query(cls).filter(
+            cls.harvest_job_id == harvest_job_id
+        ).order_by(cls.partition).all()
+
+    @classmethod
+    def unfinished_of_source(cls, harvest_source_id, harvest_job_id):
+        """
+        Partitions that the finished jobs of a harvest source did not
+        finish
+        """
+        return Session.query(cls).join(
+            HarvestJob, HarvestJob.id == cls.harvest_job_id
+        ).filter(
+            HarvestJob.source_id == harvest_source_id,
+            HarvestJob.status == "Finished",
+            cls.harvest_job_id != harvest_job_id,
+            cls.finished == False,  # noqa: E712
+        ).order_by(cls.modified).all()
+
+    @classmethod
+    def create_all(cls, harvest_job_id, partitions, replaces=()):
+        """
+        Store the partitions of a job with a single commit
+
+        :param partitions: list of (set_spec, from, until)
+        :param replaces: partitions of earlier jobs to delete in that commit
+        """
+        objects = [
+            cls(
+                harvest_job_id=harvest_job_id,
+                partition=i,
+                set_spec=set_spec,
+                from_datestamp=start,
+                until_datestamp=end,
+                object_count=0,
+                finished=False,
+            )
+            for i, (set_spec, start, end) in enumerate(partitions)
+        ]
+        for partition in replaces:
+            Session.delete(partition)
+        Session.add_all(objects)
+        Session.commit()
+        return objects
+
+    update = GatherCheckpoint.update
+
+    def __repr__(self):
+        return "<GatherPartition %s set=%s from=%s until=%s>" % (
+            self.partition, self.set_spec, self.from_datestamp, self.until_datestamp
+        )
+
+
+mapper(GatherPartition, gather_partition_table)
+
+
+class ImageQueueItem(DomainObject):
+    """
+    A molecule waiting for its structure image to be rendered
+    """
+
+    @classmethod
+    def enqueue(cls, inchi_key, inchi):
+        """
+        Add the molecule to the session unless it is queued already; it is
+        committed along with the package of the record
+        """
+        if Session.query(cls.inchi_key).filter(cls.inchi_key == inchi_key).first() is None:
+            Session.add(cls(inchi_key=inchi_key, inchi=inchi))
+
+    @classmethod
+    def pending(cls, limit):
+        return Session.query(cls).filter(
+            cls.error == None  # noqa: E711
+        ).order_by(cls.queued).limit(limit).all()
+
+
+mapper(ImageQueueItem, image_queue_table)
+
+
+class IndexQueueItem(DomainObject):
+    """
+    A package waiting to be indexed, see indexing.SearchIndexQueue
+    """
+
+
+mapper(IndexQueueItem, index_queue_table)
+
+
+def get_datestamp_watermark(harvest_source_id):
+    """
+    OAI datestamp to harvest a source incrementally from: the newest one
+    among the records successfully imported, but not past the oldest record
+    the last finished job failed to fetch or import, so that the next job
+    lists it again. None if nothing was imported yet.
+    """
+    newest = _newest_imported_datestamp(harvest_source_id)
+    oldest_failed = _oldest_failed_datestamp(harvest_source_id)
+    if oldest_failed is not None and (newest is None or oldest_failed < newest):
+        return oldest_failed
+    return newest
+
+
+def _newest_imported_datestamp(harvest_source_id):
+    return Session.query(
+        func.max(HarvestObject.metadata_modified_date)
+    ).join(
+        HarvestJob, HarvestObject.harvest_job_id == HarvestJob.id
+    ).filter(
+        HarvestJob.source_id == harvest_source_id,
+        HarvestObject.state == "COMPLETE",
+    ).scalar()
+
+
+def _oldest_failed_datestamp(harvest_source_id):
+    last_job_id = Session.query(HarvestJob.id).filter(
+        HarvestJob.source_id == harvest_source_id,
+        HarvestJob.status == "Finished",
+    ).order_by(HarvestJob.created.desc()).limit(1).scalar()
+    if last_job_id is None:
+        return None
+    return Session.query(
+        func.min(HarvestObject.metadata_modified_date)
+    ).filter(
+        HarvestObject.harvest_job_id == last_job_id,
+        HarvestObject.state != "COMPLETE",
+    ).scalar()
+
+
+
+def get_current_datestamps(harvest_source_id):
+    """
+    OAI datestamps of the current HarvestObjects of a harvest source whose
+    import completed, records whose import failed are gathered again
+
+    :returns: dict of guid -> datestamp
+    """
+    query = Session.query(
+        HarvestObject.guid, HarvestObject.metadata_modified_date
+    ).join(
+        HarvestJob, HarvestObject.harvest_job_id == HarvestJob.id
+    ).filter(
+        HarvestJob.source_id == harvest_source_id,
+        HarvestObject.current == True,  # noqa: E712
+        HarvestObject.state == "COMPLETE",
+    )
+    return dict(query)
+
+
+
+def content_hash(content):
+    """
+    Stable hash of a parsed JSON record, independent of the key order
+    """
+    data = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def get_content_hash(package_id):
+    """
+    Content hash stored with a package by its last import, if that import
+    completed. The hash is saved with the package, before the chemistry
+    rows are written; an import that failed after that must not mark the
+    record as unchanged.
+    """
+    return Session.query(PackageExtra.value).join(
+        HarvestObject, HarvestObject.package_id == PackageExtra.package_id
+    ).filter(
+        PackageExtra.package_id == package_id,
+        PackageExtra.key == CONTENT_HASH_KEY,
+        HarvestObject.current == True,  # noqa: E712
+        HarvestObject.state == "COMPLETE",
+    ).limit(1).scalar()
+
+
+def mark_unchanged(harvest_object, package_id):
+    """
+    Make harvest_object the current object of an already imported package
+    without touching the package itself
+    """
+    previous_object = Session.query(HarvestObject).filter(
+        HarvestObject.guid == harvest_object.guid,
+        HarvestObject.current == True,  # noqa: E712
+    ).first()
+    if previous_object:
+        previous_object.current = False
+        previous_object.add()
+    harvest_object.package_id = package_id
+    harvest_object.current = True
+    harvest_object.save()
+
+
+
+def get_unhandled_finished_jobs():
+    """
+    HarvestJobs of these harvesters that ckanext-harvest marked as
+    finished and whose end was not handled yet, see jobs.finish_jobs
+    """
+    return Session.query(HarvestJob).filter(
+        HarvestJob.status == "Finished",
+        HarvestJob.id.in_(select([job_timing_table.c.harvest_job_id])),
+        ~HarvestJob.id.in_(select([finished_job_table.c.harvest_job_id])),
+    ).order_by(HarvestJob.finished).all()
+
+
+def claim_finished_job(harvest_job_id):
+    """
+    Record that the end of a job is handled, committed right away
+
+    :returns: False if another process claimed the job before
+    """
+    claimed = Session.execute(
+        insert(finished_job_table).values(
+            harvest_job_id=harvest_job_id, finished=datetime.datetime.utcnow()
+        ).on_conflict_do_nothing().returning(finished_job_table.c.harvest_job_id)
+    ).first()
+    Session.commit()
+    return claimed is not None
+
+
+def claim_waiting_objects(harvest_object, limit):
+    """
+    Claim harvest_object and up to limit other objects of its job that were
+    not fetched yet, oldest first, for the prefetch of one worker. The
+    claims are committed right away, so concurrent workers prefetch other
+    objects.
+
+    :returns: the objects claimed, harvest_object first if it was
+    """
+    candidates = Session.query(HarvestObject.id).outerjoin(
+        fetch_claim_table,
+        fetch_claim_table.c.harvest_object_id == HarvestObject.id,
+    ).filter(
+        HarvestObject.harvest_job_id == harvest_object.harvest_job_id,
+        HarvestObject.id != harvest_object.id,
+        HarvestObject.state == "WAITING",
+        HarvestObject.content == None,  # noqa: E711
+        fetch_claim_table.c.harvest_object_id == None,  # noqa: E711
+    ).order_by(HarvestObject.gathered).limit(limit)
+    ids = [harvest_object.id] + [object_id for (object_id,) in candidates]
+    now = datetime.datetime.utcnow()
+    claimed = set(
+        object_id for (object_id,) in Session.execute(
+            insert(fetch_claim_table).values([
+                {"harvest_object_id": object_id,
+                 "harvest_job_id": harvest_object.harvest_job_id,
+                 "claimed": now}
+                for object_id in ids
+            ]).on_conflict_do_nothing().returning(
+                fetch_claim_table.c.harvest_object_id
+            )
+        )
+    )
+    Session.commit()
+    others = []
+    if claimed - set([harvest_object.id]):
+        others = Session.query(HarvestObject).filter(
+            HarvestObject.id.in_(claimed - set([harvest_object.id]))
+        ).order_by(HarvestObject.gathered).all()
+    if harvest_object.id in claimed:
+        return [harvest_object] + others
+    return others
+
+
+def release_fetch_claims(harvest_job_id):
+    """
+    Delete the prefetch claims of a finished job
+    """
+    Session.execute(fetch_claim_table.delete().where(
+        fetch_claim_table.c.harvest_job_id == harvest_job_id
+    ))
+    Session.commit()
+
+
+def setup():
+    """
+    Create the tables of this extension if they do not exist yet
+    """
+    existing = set(inspect(meta.engine).get_table_names())
+    for table in (
+            gather_checkpoint_table, gather_partition_table, image_queue_table,
+            job_timing_table, index_queue_table, fetch_claim_table,
+            finished_job_table,
+    ):
+        if table.name not in existing:
+            table.create(meta.engine)
+            log.debug("Table %s created" % table.name)
@@ -1,9 +1,16 @@
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
 
+from ckanext.massbankharvester import cli
+from ckanext.massbankharvester import jobs
+from ckanext.massbankharvester import views
+
 
 class MassbankharvesterPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IClick)
+    plugins.implements(plugins.IBlueprint)
+    plugins.implements(plugins.IActions)
     
 
     # IConfigurer
@@ -13,4 +20,19 @@ class MassbankharvesterPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, "public")
         toolkit.add_resource("assets", "massbankharvester")
 
+    # IClick
+
+    def get_commands(self):
+        return cli.get_commands()
+
+    # IBlueprint
+
+    def get_blueprint(self):
+        return views.get_blueprints()
+
+    # IActions
+
+    def get_actions(self):
+        return {"harvest_jobs_run": jobs.harvest_jobs_run}
+
     
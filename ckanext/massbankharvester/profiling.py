@@ -0,0 +1,172 @@
+"""
+Opt-in cProfile runs of the fetch and import stages.
+
+With ``profile_every`` N (source config, or
+``ckanext.massbankharvester.profile_every`` as default for all sources),
+every Nth fetch_stage and import_stage call of a worker is profiled. The
+profiles are written to ``<profile dir>/<harvest job id>/`` and merged
+into one profile per stage when the job is finished, e.g. for
+``python -m pstats`` or snakeviz.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.massbankharvester.cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+AGGREGATE_PREFIX = "aggregate-"
+
+# source config -> profile_every
+_profile_every = LRUCache(maxsize=32)
+_stage_profiler = None
+
+
+class StageProfiler(object):
+    """
+    Profiles every Nth call of a harvest stage, counted per job and stage
+    in this process
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    def profile(self, stage, harvest_job_id, guid, every):
+        """
+        :returns: context manager profiling the call if it is an Nth one
+        """
+        if not every:
+            return nullcontext()
+        with self._lock:
+            self._calls[(harvest_job_id, stage)] += 1
+            call = self._calls[(harvest_job_id, stage)]
+        if call % every:
+            return nullcontext()
+        return self._run(stage, harvest_job_id, guid, call)
+
+    @contextmanager
+    def _run(self, stage, harvest_job_id, guid, call):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._dump(profile, stage, harvest_job_id, guid, call)
+
+    def _dump(self, profile, stage, harvest_job_id, guid, call):
+        directory = os.path.join(self.directory, harvest_job_id)
+        # the guid is an OAI identifier like oai:massbank.eu:MSBNK-...
+        name = "%s-%s-%s-%s.prof" % (
+            stage, re.sub(r"[^\w.-]", "_", guid or "")[:100], os.getpid(), call
+        )
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(os.path.join(directory, name))
+        except OSError:
+            log.exception("Writing profile %s failed" % name)
+
+    def merge(self, harvest_job_id):
+        """
+        Merge the profiles of a job into one aggregate per stage, as
+        aggregate-<stage>.prof and a text report sorted by cumulative time
+
+        :returns: paths of the merged profiles
+        """
+        directory = os.path.join(self.directory, harvest_job_id)
+        try:
+            filenames = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return []
+        by_stage = {}
+        for filename in filenames:
+            if filename.endswith(".prof") and not filename.startswith(AGGREGATE_PREFIX):
+                stage = filename.split("-", 1)[0]
+                by_stage.setdefault(stage, []).append(os.path.join(directory, filename))
+
+        merged = []
+        for stage, paths in sorted(by_stage.items()):
+            path = os.path.join(directory, "%s%s.prof" % (AGGREGATE_PREFIX, stage))
+            with open(path[:-len(".prof")] + ".txt", "w") as report:
+                stats = pstats.Stats(*paths, stream=report)
+                report.write("%s profiles of %s\n" % (len(paths), stage))
+                stats.sort_stats("cumulative").print_stats(50)
+            stats.dump_stats(path)
+            merged.append(path)
+        log.info(
+            "Merged the profiles of job %s into %s" % (harvest_job_id, ", ".join(merged))
+        )
+        return merged
+
+
+def get_profile_dir():
+    return toolkit.config.get(
+        "ckanext.massbankharvester.profile_dir",
+        os.path.join(
+            toolkit.config.get("ckan.storage_path") or tempfile.gettempdir(),
+            "massbankharvester",
+            "profiles",
+        ),
+    )
+
+
+def get_stage_profiler():
+    """
+    Process-wide StageProfiler
+    """
+    global _stage_profiler
+    if _stage_profiler is None:
+        _stage_profiler = StageProfiler(get_profile_dir())
+    return _stage_profiler
+
+
+def get_profile_every(source_config):
+    """
+    "profile_every" of a harvest source config, the ini default otherwise
+    """
+    every = _profile_every.get(source_config)
+    if every is None:
+        every = int(toolkit.config.get("ckanext.massbankharvester.profile_every", 0))
+        try:
+            every = int(json.loads(source_config).get("profile_every", every))
+        except (TypeError, ValueError, AttributeError):
+            pass
+        _profile_every.set(source_config, every)
+    return every
+
+
+def profile_stage(stage, harvest_object):
+    """
+    Context manager around a fetch_stage/import_stage call, profiling it if
+    it is an Nth one
+    """
+    every = get_profile_every(harvest_object.job.source.config)
+    if not every:
+        return nullcontext()
+    return get_stage_profiler().profile(
+        stage, harvest_object.harvest_job_id, harvest_object.guid, every
+    )
+
+
+def merge_job_profiles(harvest_job):
+    """
+    Merge the profiles of a HarvestJob, if it was profiled
+    """
+    if get_profile_every(harvest_job.source.config):
+        try:
+            get_stage_profiler().merge(harvest_job.id)
+        except Exception:
+            log.exception("Merging the profiles of job %s failed" % harvest_job.id)
@@ -0,0 +1,26 @@
+"""
+Tests for cache.py.
+"""
+from ckanext.massbankharvester.cache import LRUCache
+
+
+def test_lru_cache_get_and_set():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", 2) == 2
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert len(cache) == 2
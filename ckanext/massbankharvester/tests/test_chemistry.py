@@ -0,0 +1,44 @@
+"""
+Tests for chemistry.py.
+"""
+import sqlite3
+
+from ckanext.massbankharvester.chemistry import MoleculeCache
+
+VALUES = {
+    "mol_weight": 180.16,
+    "exact_mass": 180.063,
+    "formula": "C6H12O6",
+    "image_path": "/tmp/WQZGKKKJIJFFOK-GASJEMHNSA-N.png",
+}
+
+
+def test_molecule_cache_persists_on_disk(tmp_path):
+    path = str(tmp_path / "molecules.sqlite")
+    MoleculeCache(path).set("WQZGKKKJIJFFOK-GASJEMHNSA-N", VALUES)
+
+    cache = MoleculeCache(path)
+    assert cache.get("WQZGKKKJIJFFOK-GASJEMHNSA-N") == VALUES
+    assert cache.get("XLYOFNOQVPJJNP-UHFFFAOYSA-N") is None
+
+
+def test_molecule_cache_without_path_stays_in_memory():
+    cache = MoleculeCache(maxsize=1)
+    cache.set("WQZGKKKJIJFFOK-GASJEMHNSA-N", VALUES)
+
+    assert cache.get("WQZGKKKJIJFFOK-GASJEMHNSA-N") == VALUES
+
+
+def test_molecule_cache_falls_back_to_memory_when_sqlite_fails(tmp_path, caplog):
+    path = str(tmp_path / "molecules.sqlite")
+    cache = MoleculeCache(path)
+    # another worker holds the write lock
+    other = sqlite3.connect(path)
+    other.execute("BEGIN EXCLUSIVE")
+    cache._db.execute("PRAGMA busy_timeout = 0")
+
+    cache.set("WQZGKKKJIJFFOK-GASJEMHNSA-N", VALUES)
+    assert cache.get("WQZGKKKJIJFFOK-GASJEMHNSA-N") == VALUES
+    assert cache.get("XLYOFNOQVPJJNP-UHFFFAOYSA-N") is None
+    assert "database is locked" in caplog.text
+    other.rollback()
@@ -0,0 +1,460 @@
+"""
+Tests for the gather, fetch and import logic of harvester/base.py, with
+fakes for the database, the OAI-PMH client and CKAN.
+"""
+import datetime
+import json
+from contextlib import contextmanager
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.massbankharvester import model
+from ckanext.massbankharvester.harvester import base
+from ckanext.massbankharvester.harvester.base import OAIJSONHarvester
+from ckanext.massbankharvester.harvester.oai import Page
+from ckanext.massbankharvester.model import content_hash
+
+CONFIG = {"from": "2023-01-01T00:00:00Z", "until": "2023-01-02T23:59:59Z"}
+NEW = datetime.datetime(2023, 1, 2)
+
+
+class Header(object):
+    def __init__(self, identifier, datestamp=NEW):
+        self._identifier = identifier
+        self._datestamp = datestamp
+
+    def identifier(self):
+        return self._identifier
+
+    def datestamp(self):
+        return self._datestamp
+
+    def isDeleted(self):
+        return False
+
+
+def page(items, token=None):
+    def read():
+        yield from items
+        return token
+    return Page(read())
+
+
+class FakeQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *criteria):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeSession(object):
+    """
+    Records the saved objects; bulk_save_objects raises from the call
+    number fail_at on
+    """
+
+    def __init__(self, rows=(), fail_at=None):
+        self.rows = list(rows)
+        self.fail_at = fail_at
+        self.batches = []
+        self.commits = 0
+
+    def query(self, *entities):
+        return FakeQuery(self.rows)
+
+    def bulk_save_objects(self, objects):
+        if self.fail_at is not None and len(self.batches) + 1 >= self.fail_at:
+            raise IOError("database gone")
+        self.batches.append([obj.guid for obj in objects])
+
+    def commit(self):
+        self.commits += 1
+
+    def add(self, obj):
+        pass
+
+
+class FakeHarvestObject(object):
+    # column stand-ins for the queries
+    id = guid = harvest_job_id = None
+    content = None
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Checkpoint(object):
+    def __init__(self, resumption_token=None, object_count=0, finished=False, **window):
+        self.resumption_token = resumption_token
+        self.object_count = object_count
+        self.finished = finished
+        self.updates = []
+        self.__dict__.update(window)
+
+    def update(self, resumption_token, object_count):
+        self.resumption_token = resumption_token
+        self.object_count = object_count
+        self.finished = resumption_token is None
+        self.updates.append((resumption_token, object_count))
+
+
+class Timings(object):
+    @contextmanager
+    def time(self, step):
+        yield
+
+    def observe(self, step, seconds):
+        pass
+
+
+def make_job(config):
+    source = SimpleNamespace(id="source", url="https://oai.example.org", config=json.dumps(config))
+    return SimpleNamespace(id="job", source=source)
+
+
+@pytest.fixture
+def harvester(monkeypatch):
+    harvester = OAIJSONHarvester()
+    errors = []
+    monkeypatch.setattr(harvester, "timings", Timings(), raising=False)
+    monkeypatch.setattr(harvester, "errors", errors, raising=False)
+    monkeypatch.setattr(
+        harvester, "_get_client",
+        lambda url: SimpleNamespace(identify=lambda: None), raising=False,
+    )
+    monkeypatch.setattr(
+        harvester, "_save_gather_error",
+        lambda message, job: errors.append(message), raising=False,
+    )
+    monkeypatch.setattr(
+        harvester, "_save_object_error",
+        lambda message, obj=None: errors.append(message), raising=False,
+    )
+    monkeypatch.setattr(base, "HarvestObject", FakeHarvestObject)
+    monkeypatch.setattr(base, "get_current_datestamps", lambda source_id: {})
+    return harvester
+
+
+def gather(harvester, monkeypatch, pages, config=None, session=None, checkpoint=None):
+    listed = []
+
+    def list_pages(client, resumption_token=None, *partition):
+        listed.append((resumption_token,) + partition)
+        return pages(*partition) if callable(pages) else iter(pages)
+
+    checkpoint = checkpoint or Checkpoint()
+    monkeypatch.setattr(harvester, "_list_pages", list_pages)
+    monkeypatch.setattr(base, "Session", session or FakeSession())
+    monkeypatch.setattr(
+        base, "GatherCheckpoint",
+        SimpleNamespace(get_or_create=lambda harvest_job_id: checkpoint),
+    )
+    # None drops an option of CONFIG
+    config = dict(
+        (key, value) for key, value in dict(CONFIG, **(config or {})).items()
+        if value is not None
+    )
+    return harvester._gather(make_job(config)), listed
+
+
+def test_gather_resumes_and_skips_saved_and_unchanged_records(harvester, monkeypatch):
+    # rec-1 was saved before the gather was interrupted at token t0
+    session = FakeSession(rows=[("saved-id", "rec-1")])
+    checkpoint = Checkpoint("t0", 1)
+    monkeypatch.setattr(base, "get_current_datestamps", lambda source_id: {"rec-2": NEW})
+
+    ids, listed = gather(harvester, monkeypatch, [
+        page([Header("rec-1"), Header("rec-2"), Header("rec-3")], "t1"),
+        page([Header("rec-4"), Header("rec-5"), Header("rec-2", NEW + datetime.timedelta(1))]),
+    ], {"gather_batch_size": 1}, session, checkpoint)
+
+    assert listed == [("t0",)]
+    assert session.batches == [["rec-3"], ["rec-4", "rec-5", "rec-2"], []]
+    assert checkpoint.updates == [("t1", 2), (None, 5)]
+    assert ids[0] == "saved-id"
+    assert len(ids) == 5
+
+
+def test_gather_of_a_finished_job_lists_nothing(harvester, monkeypatch):
+    session = FakeSession(rows=[("saved-id", "rec-1")])
+
+    ids, listed = gather(harvester, monkeypatch, [], session=session,
+                         checkpoint=Checkpoint(finished=True))
+
+    assert ids == ["saved-id"]
+    assert listed == []
+
+
+def test_records_the_last_job_failed_on_are_listed_again(harvester, monkeypatch):
+    # imported up to January 10th, but the record of January 3rd failed
+    monkeypatch.setattr(
+        model, "_newest_imported_datestamp", lambda source_id: datetime.datetime(2023, 1, 10)
+    )
+    monkeypatch.setattr(
+        model, "_oldest_failed_datestamp", lambda source_id: datetime.datetime(2023, 1, 3)
+    )
+    session = FakeSession()
+
+    ids, _ = gather(harvester, monkeypatch, [
+        page([Header("failed", datetime.datetime(2023, 1, 3)), Header("new")]),
+    ], {"from": None, "until": None}, session)
+
+    # the watermark minus the overlap of 60 minutes
+    assert harvester.set_from == "2023-01-02T23:00:00Z"
+    assert session.batches == [["failed", "new"]]
+    assert len(ids) == 2
+
+
+def test_failing_batch_keeps_the_checkpoint_of_the_saved_one(harvester, monkeypatch):
+    session = FakeSession(fail_at=2)
+    checkpoint = Checkpoint()
+
+    ids, _ = gather(harvester, monkeypatch, [
+        page([Header("rec-1")], "t1"),
+        page([Header("rec-2")], "t2"),
+        page([Header("rec-3")]),
+    ], {"gather_batch_size": 1}, session, checkpoint)
+
+    assert ids is None
+    assert session.batches == [["rec-1"]]
+    assert checkpoint.updates == [("t1", 1)]
+    assert checkpoint.resumption_token == "t1"
+    assert len(harvester.errors) == 1
+
+
+def test_list_records_saves_records_with_invalid_metadata_without_content(harvester, monkeypatch):
+    session = FakeSession()
+
+    def get_content(header, metadata):
+        if metadata == "invalid":
+            raise ValueError("not a JSON container")
+        return '{"name": "%s"}' % header.identifier()
+
+    monkeypatch.setattr(harvester, "_get_content", get_content)
+    saved = []
+    monkeypatch.setattr(session, "bulk_save_objects", saved.extend)
+
+    ids, _ = gather(harvester, monkeypatch, [page([
+        (Header("rec-1"), "valid", None),
+        (Header("rec-2"), "invalid", None),
+    ])], {"list_records": True}, session)
+
+    assert len(ids) == 2
+    assert [(obj.guid, obj.content) for obj in saved] == [
+        ("rec-1", '{"name": "rec-1"}'), ("rec-2", None),
+    ]
+
+
+class FakePartitions(object):
+    def __init__(self, unfinished):
+        self.unfinished = unfinished
+        self.created = []
+        self.replaced = []
+
+    def for_job(self, harvest_job_id):
+        return self.created
+
+    def unfinished_of_source(self, harvest_source_id, harvest_job_id):
+        return self.unfinished
+
+    def create_all(self, harvest_job_id, partitions, replaces=()):
+        self.created = [
+            Checkpoint(set_spec=set_spec, from_datestamp=start, until_datestamp=end)
+            for set_spec, start, end in partitions
+        ]
+        self.replaced = list(replaces)
+        return self.created
+
+
+def test_failed_partitions_are_carried_over_to_the_next_job(harvester, monkeypatch):
+    left_over = Checkpoint(
+        set_spec=None, from_datestamp="2022-12-01T00:00:00Z",
+        until_datestamp="2022-12-01T23:59:59Z",
+    )
+    partitions = FakePartitions([left_over])
+    monkeypatch.setattr(base, "GatherPartition", partitions)
+    checkpoint = Checkpoint()
+
+    def pages(set_spec, start, end):
+        def items():
+            yield Header("rec-" + start[:10])
+            if start.startswith("2023-01-02"):
+                # cuts the page short
+                raise IOError("connection reset")
+        yield Page(items())
+
+    ids, listed = gather(
+        harvester, monkeypatch, pages, {"partition_days": 1}, checkpoint=checkpoint
+    )
+
+    assert sorted(window[2] for window in listed) == [
+        "2022-12-01T00:00:00Z", "2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z",
+    ]
+    assert partitions.replaced == [left_over]
+    assert len(ids) == 3
+    assert [p.finished for p in partitions.created] == [True, False, True]
+    # the record read before the failure is saved, the token is not
+    assert partitions.created[1].updates == []
+    assert "the next job gathers it again" in harvester.errors[0]
+    # the gather of the job is not finished while a partition is not
+    assert checkpoint.updates == []
+
+
+class Mapping(object):
+    def __init__(self, chemistry=None):
+        self.chemistry = chemistry
+
+    def apply(self, content, lookup=None):
+        return SimpleNamespace(
+            package={"title": content["name"]}, resources=[], extras=[],
+            chemistry=self.chemistry, molecule=None,
+        )
+
+
+CHEMISTRY = {
+    "inchi": "InChI=1S/CH4/h1H4", "smiles": "C", "inchi_key": "VNWKTOKETHGBQD-UHFFFAOYSA-N",
+    "exact_mass": 16.0313, "mol_formula": "CH4", "alternate_names": ["Methane"],
+}
+
+
+@pytest.fixture
+def importer(harvester, monkeypatch):
+    packages = []
+    # the source settings of the test, see set_source_settings
+    settings = {}
+
+    def set_source_settings(harvest_object):
+        harvester.skip_unchanged = True
+        harvester.index_mode = "none"
+        harvester.owner_org = "org"
+        harvester.needs_molecule = False
+        harvester.mapping = Mapping()
+        harvester.__dict__.update(settings)
+
+    monkeypatch.setattr(harvester, "packages", packages, raising=False)
+    monkeypatch.setattr(harvester, "settings", settings, raising=False)
+    monkeypatch.setattr(harvester, "_set_source_settings", set_source_settings)
+    monkeypatch.setattr(
+        harvester, "_create_or_update_package",
+        lambda package_dict, harvest_object, action: packages.append(package_dict),
+        raising=False,
+    )
+    monkeypatch.setattr(base, "Session", FakeSession())
+    monkeypatch.setattr(base, "get_content_hash", lambda package_id: None)
+    monkeypatch.setattr(base, "get_job_timings", lambda job_id, source_id: Timings())
+    monkeypatch.setattr(base, "profile_stage", lambda stage, obj: nullcontext())
+    return harvester
+
+
+def harvest_object(name="Methane"):
+    return FakeHarvestObject(
+        guid="MSBNK-1", harvest_job_id="job", harvest_source_id="source",
+        content=json.dumps({"name": name}),
+    )
+
+
+def test_import_skips_unchanged_records(importer, monkeypatch):
+    obj = harvest_object()
+    unchanged = []
+    monkeypatch.setattr(base, "get_content_hash", lambda package_id: content_hash({"name": "Methane"}))
+    monkeypatch.setattr(base, "mark_unchanged", lambda obj, package_id: unchanged.append(package_id))
+
+    assert importer.import_stage(obj) == "unchanged"
+    assert unchanged == ["msbnk-1"]
+    assert importer.packages == []
+
+
+def test_import_fails_when_the_chemistry_rows_fail(importer, monkeypatch):
+    written = []
+
+    def write_chemistry(molecule, names=()):
+        written.append((molecule, list(names)))
+        raise IOError("chemistry db gone")
+
+    monkeypatch.setattr(base, "write_chemistry", write_chemistry)
+    importer.settings["mapping"] = Mapping(CHEMISTRY)
+
+    assert importer.import_stage(harvest_object()) is False
+    assert importer.packages[0]["extras"] == [
+        {"key": base.CONTENT_HASH_KEY, "value": content_hash({"name": "Methane"})}
+    ]
+    assert written == [(
+        ("msbnk-1", json.dumps(CHEMISTRY["inchi"]), "C", CHEMISTRY["inchi_key"], 16.0313, "CH4"),
+        [("msbnk-1", "Methane")],
+    )]
+    assert "chemistry db gone" in importer.errors[0]
+
+
+class FakeIndexQueue(object):
+    def __init__(self, batch_size, fail=False):
+        self.batch_size = batch_size
+        self.fail = fail
+        self.queued = []
+        self.indexed = []
+
+    def add(self, package_id, harvest_job_id):
+        self.queued.append(package_id)
+
+    def due(self):
+        return len(self.queued) - sum(len(batch) for batch in self.indexed) >= self.batch_size
+
+    def index(self, harvest_job_id):
+        if self.fail:
+            raise IOError("solr gone")
+        done = sum(len(batch) for batch in self.indexed)
+        self.indexed.append(self.queued[done:])
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_batch_index_mode_indexes_full_batches(importer, monkeypatch, fail):
+    queue = FakeIndexQueue(2, fail)
+    monkeypatch.setattr(base, "get_search_index_queue", lambda: queue)
+    importer.settings["index_mode"] = "batch"
+
+    guids = ["MSBNK-A", "MSBNK-B", "MSBNK-C"]
+    for guid in guids:
+        obj = harvest_object(guid)
+        obj.guid = guid
+        # a failing index leaves the imports alone
+        assert importer.import_stage(obj) is True
+
+    # the package names of the guids
+    names = [base.munge_title_to_name(guid) for guid in guids]
+    assert queue.queued == names
+    assert queue.indexed == ([] if fail else [names[:2]])
+
+
+def test_prefetch_only_fetches_claimed_objects(harvester, monkeypatch):
+    own, other = FakeHarvestObject(guid="own"), FakeHarvestObject(guid="other")
+    requested = []
+    session = FakeSession()
+    monkeypatch.setattr(base, "Session", session)
+    monkeypatch.setattr(harvester, "md_format", "json", raising=False)
+    monkeypatch.setattr(harvester, "fetch_concurrency", 2, raising=False)
+    monkeypatch.setattr(harvester, "prefetch_window", 10, raising=False)
+    monkeypatch.setattr(harvester, "_get_content", lambda header, metadata: metadata)
+
+    def get_record(identifier, metadataPrefix):
+        requested.append(identifier)
+        return Header(identifier), '{"id": "%s"}' % identifier, None
+
+    client = SimpleNamespace(getRecord=get_record)
+
+    # another worker claimed harvest_object itself
+    monkeypatch.setattr(base, "claim_waiting_objects", lambda obj, limit: [other])
+    harvester._prefetch_records(own, client)
+    assert requested == ["other"]
+    assert own.content is None
+    assert other.content == '{"id": "other"}'
+
+    # and everything else
+    requested[:] = []
+    monkeypatch.setattr(base, "claim_waiting_objects", lambda obj, limit: [])
+    harvester._prefetch_records(own, client)
+    assert requested == []
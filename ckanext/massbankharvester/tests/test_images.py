@@ -0,0 +1,85 @@
+"""
+Tests for images.py.
+"""
+import os
+
+from ckanext.massbankharvester import images
+from ckanext.massbankharvester.cache import LRUCache
+from ckanext.massbankharvester.images import evict_images
+from ckanext.massbankharvester.images import image_path
+from ckanext.massbankharvester.images import migrate_flat_dir
+
+
+def _write_image(directory, name, size, mtime):
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_images_removes_least_recently_used(tmp_path):
+    oldest = _write_image(tmp_path, "A.png", 400, 1000)
+    older = _write_image(tmp_path, "B.png", 400, 2000)
+    newest = _write_image(tmp_path, "C.png", 400, 3000)
+
+    assert evict_images(str(tmp_path), 1000) == 1
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older)
+    assert os.path.exists(newest)
+
+
+def test_evict_images_below_limit(tmp_path):
+    _write_image(tmp_path, "A.png", 400, 1000)
+
+    assert evict_images(str(tmp_path), 1000) == 0
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_image_path_is_sharded(tmp_path):
+    inchi_key = "WQZGKKKJIJFFOK-GASJEMHNSA-N"
+
+    assert image_path(inchi_key, str(tmp_path)) == os.path.join(
+        str(tmp_path), "WQ", "ZG", inchi_key + ".png"
+    )
+    assert image_path(inchi_key, str(tmp_path), "svg", 120) == os.path.join(
+        str(tmp_path), "WQ", "ZG", inchi_key + "_120.svg"
+    )
+
+
+def test_migrate_flat_dir(tmp_path):
+    inchi_key = "WQZGKKKJIJFFOK-GASJEMHNSA-N"
+    _write_image(tmp_path, inchi_key + ".png", 10, 1000)
+
+    assert migrate_flat_dir(str(tmp_path)) == 1
+    assert os.path.isfile(image_path(inchi_key, str(tmp_path)))
+    assert not os.path.exists(os.path.join(str(tmp_path), inchi_key + ".png"))
+
+
+def test_find_inchi_remembers_unknown_keys(monkeypatch):
+    queries = []
+
+    class Connection(object):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def execute(self, statement, **params):
+            queries.append(params)
+            return self
+
+        def scalar(self):
+            return None
+
+    class Engine(object):
+        def connect(self):
+            return Connection()
+
+    monkeypatch.setattr(images, "get_engine", Engine)
+    monkeypatch.setattr(images, "_misses", LRUCache())
+
+    assert images.find_inchi("XLYOFNOQVPJJNP-UHFFFAOYSA-N") is None
+    assert images.find_inchi("XLYOFNOQVPJJNP-UHFFFAOYSA-N") is None
+    assert queries == [{"inchi_key": "XLYOFNOQVPJJNP-UHFFFAOYSA-N"}]
@@ -0,0 +1,39 @@
+"""
+Tests for indexing.py.
+"""
+from ckanext.massbankharvester import indexing
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+
+def test_queue_is_due_after_a_batch_or_max_wait(monkeypatch):
+    session = FakeSession()
+    clock = [1000.0]
+    indexed = []
+    monkeypatch.setattr(indexing, "Session", session)
+    monkeypatch.setattr(indexing.time, "time", lambda: clock[0])
+    monkeypatch.setattr(
+        indexing, "index_queued",
+        lambda harvest_job_id, max_wait: indexed.append((harvest_job_id, max_wait)),
+    )
+    queue = indexing.SearchIndexQueue(batch_size=2, max_wait=60)
+
+    assert not queue.due()
+    queue.add("a", "job")
+    assert not queue.due()
+    queue.add("b", "job")
+    assert queue.due()
+    queue.index("job")
+    assert indexed == [("job", 60)]
+    assert not queue.due()
+
+    queue.add("c", "job")
+    clock[0] += 60
+    assert queue.due()
+    assert len(session.statements) == 3
@@ -0,0 +1,42 @@
+"""
+Tests for jobs.py.
+"""
+from types import SimpleNamespace
+
+from ckanext.massbankharvester import jobs
+
+
+def test_finish_jobs_handles_each_claimed_job_once(monkeypatch):
+    finished = [SimpleNamespace(id="a"), SimpleNamespace(id="b")]
+    claimed = set(["b"])
+    indexed, summaries, merged = [], [], []
+
+    def claim(harvest_job_id):
+        if harvest_job_id in claimed:
+            return False
+        claimed.add(harvest_job_id)
+        return True
+
+    monkeypatch.setattr(jobs, "get_unhandled_finished_jobs", lambda: finished)
+    monkeypatch.setattr(jobs, "claim_finished_job", claim)
+    monkeypatch.setattr(jobs, "index_queued", indexed.append)
+    monkeypatch.setattr(jobs, "release_fetch_claims", lambda harvest_job_id: None)
+    monkeypatch.setattr(jobs, "log_job_summary", summaries.append)
+    monkeypatch.setattr(jobs, "merge_job_profiles", merged.append)
+
+    assert jobs.finish_jobs() == ["a"]
+    assert indexed == summaries == ["a"]
+    assert merged == [finished[0]]
+    assert jobs.finish_jobs() == []
+
+
+def test_harvest_jobs_run_survives_failures(monkeypatch):
+    def fail():
+        raise IOError("database gone")
+
+    monkeypatch.setattr(jobs, "finish_jobs", fail)
+
+    def original_action(context, data_dict):
+        return ["job"]
+
+    assert jobs.harvest_jobs_run(original_action, {}, {}) == ["job"]
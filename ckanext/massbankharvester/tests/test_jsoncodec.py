@@ -0,0 +1,33 @@
+"""
+Tests for jsoncodec.py.
+"""
+import json
+import math
+import re
+
+import pytest
+
+from ckanext.massbankharvester import jsoncodec
+
+
+@pytest.mark.parametrize("json_data", [
+    ['{\n  "name": "a  b",\n  "description": "line\nbreak"\n}'],
+    [' {"a":\n\n 1, ', '"b": [1,  2]}  \n'],
+    ['\t{"a": "x y"}\t'],
+])
+def test_normalize_container_matches_regex(json_data):
+    expected = re.sub(r'[\n ]+', ' ', ''.join(json_data)).strip()
+
+    text, value = jsoncodec.normalize_container(json_data)
+
+    assert text == expected
+    assert value == json.loads(expected)
+
+
+def test_normalize_container_rejects_invalid_json():
+    with pytest.raises(ValueError):
+        jsoncodec.normalize_container(['{"a": '])
+
+
+def test_loads_falls_back_to_standard_library():
+    assert math.isnan(jsoncodec.loads('{"n": NaN}')["n"])
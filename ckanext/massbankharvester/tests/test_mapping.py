@@ -0,0 +1,161 @@
+"""
+Tests for harvester/mapping.py and the profiles of harvester/profiles.py.
+"""
+import pytest
+
+from ckanext.massbankharvester.harvester.mapping import MISSING
+from ckanext.massbankharvester.harvester.mapping import MappingError
+from ckanext.massbankharvester.harvester.mapping import compile_path
+from ckanext.massbankharvester.harvester.mapping import compile_profile
+
+INCHI = "InChI=1S/CH4/h1H4"
+MOLECULE = {"mol_weight": 16.043, "exact_mass": 16.0313, "formula": "CH4"}
+
+
+def lookup(inchi_key, inchi):
+    assert inchi == INCHI
+    return MOLECULE
+
+
+def test_compile_path():
+    get = compile_path("1.about.parts.-1.key")
+    record = [{}, {"about": {"parts": [{"key": "a"}, {"key": "b"}]}}]
+
+    assert get(record) == "b"
+    assert get([{}]) is MISSING
+    assert get([{}, {"about": {"parts": []}}]) is MISSING
+    assert get([{}, {"about": {"parts": "text"}}]) is MISSING
+    assert get([{}, {"about": {"parts": [{"key": None}]}}]) is MISSING
+    assert compile_path("name")({"name": ["x"]}) == ["x"]
+
+
+def test_alternative_paths_converters_and_defaults():
+    mapping = compile_profile({
+        "package": {
+            "notes": ["part.description", "description"],
+            "maintainer": {"path": "publisher", "convert": "first"},
+            "author": {"path": "authors", "convert": "join"},
+            "license_id": {"path": "license", "default": "CC-BY-4.0"},
+        },
+        "extras": {
+            "published": {"path": "datePublished", "convert": "datetime"},
+            "created": {"path": "dateCreated", "convert": "datetime"},
+        },
+    })
+    record = mapping.apply({
+        "description": "study",
+        "publisher": ["MassBank", "other"],
+        "authors": ["Doe J", "Roe R"],
+        "datePublished": "2023-03-01T10:00:00+00:00",
+        "dateCreated": "",
+    })
+
+    assert record.package == {
+        "notes": "study",
+        "maintainer": "MassBank",
+        "author": "Doe J, Roe R",
+        "license_id": "CC-BY-4.0",
+    }
+    assert record.extras == [{"key": "published", "value": "2023-03-01T10:00:00"}]
+    assert record.chemistry is None
+    assert record.molecule is None
+
+
+def test_required_value_missing():
+    mapping = compile_profile({"package": {"title": {"path": "name", "required": True}}})
+
+    with pytest.raises(MappingError):
+        mapping.apply({"title": "no name"})
+
+
+@pytest.mark.parametrize("profile", [
+    "unknown",
+    {"packages": {}},
+    {"package": {"title": {"path": "name", "convert": "upper"}}},
+    {"package": {"title": {"path": "name", "molecule": "mol_weight"}}},
+    {"chemistry": {"mass": "mass"}},
+    {"extras": {"mass": {"molecule": "exact_mass"}}},
+])
+def test_invalid_profiles(profile):
+    with pytest.raises(MappingError):
+        compile_profile(profile)
+
+
+def test_massbank_profile():
+    record = compile_profile("massbank").apply({
+        "name": "Methane; EI-B; MS",
+        "description": "MS spectrum of methane",
+        "url": "https://massbank.eu/MassBank/RecordDisplay?id=MSBNK-1",
+        "format": ["text/plain"],
+        "inChI": INCHI,
+        "inchikey": "VNWKTOKETHGBQD-UHFFFAOYSA-N",
+        "smiles": "C",
+        "molecularFormula": "CH4",
+        "monoisotopicMolecularWeight": 16.0313,
+        "alternateName": "Methane",
+        "dateModified": "2023-02-01",
+    }, lookup)
+
+    assert record.package["title"] == "Methane; EI-B; MS"
+    assert record.package["notes"] == "MS spectrum of methane"
+    assert "maintainer" not in record.package
+    assert record.resources == [{
+        "name": "Methane; EI-B; MS",
+        "resource_type": "text/plain",
+        "format": "text/plain",
+        "url": "https://massbank.eu/MassBank/RecordDisplay?id=MSBNK-1",
+    }]
+    assert [extra["key"] for extra in record.extras] == [
+        "inchi", "inchi_key", "smiles", "exactmass", "dateModified"
+    ]
+    assert record.chemistry["alternate_names"] == ["Methane"]
+    assert record.chemistry["exact_mass"] == 16.0313
+    assert record.molecule == MOLECULE
+    # nothing of the profile needs RDKit
+    assert not compile_profile("massbank").uses_molecule
+
+
+def test_nmrxiv_profile():
+    molecule = {
+        "inChI": INCHI,
+        "inChIKey": "VNWKTOKETHGBQD-UHFFFAOYSA-N",
+        "smiles": ["", "", "C"],
+        "molecularFormula": "CH4",
+    }
+    study = {
+        "name": "NMR study",
+        "description": "1D NMR spectra",
+        "url": "https://nmrxiv.org/S1",
+        "isPartOf": {"citation": {"author": ["Doe J", "Roe R"]}},
+        "about": {
+            "name": "Sample",
+            "url": "https://nmrxiv.org/S1/sample",
+            "hasBioChemEntityPart": [molecule],
+        },
+    }
+    record = compile_profile("nmrxiv").apply([{"name": "Dataset"}, study], lookup)
+
+    assert record.package == {
+        "title": "NMR study",
+        "notes": "1D NMR spectra",
+        "url": "https://nmrxiv.org/S1",
+        "author": "Doe J, Roe R",
+    }
+    assert record.resources[0]["format"] == "HTML"
+    extras = dict((extra["key"], extra["value"]) for extra in record.extras)
+    assert extras["smiles"] == "C"
+    assert extras["exactmass"] == 16.043
+    assert record.chemistry["exact_mass"] == 16.0313
+    assert record.chemistry["alternate_names"] == []
+    assert compile_profile("nmrxiv").uses_molecule
+
+    # an InChI RDKit can't parse leaves out the RDKit values
+    record = compile_profile("nmrxiv").apply([{}, study], lambda inchi_key, inchi: None)
+    assert record.molecule is None
+    assert record.chemistry["exact_mass"] is None
+
+    # without a standard InChI there is no molecule to look up
+    molecule["inChI"] = "not an InChI"
+    record = compile_profile("nmrxiv").apply([{}, study], lookup)
+    assert record.molecule is None
+    assert "exactmass" not in dict((extra["key"], extra["value"]) for extra in record.extras)
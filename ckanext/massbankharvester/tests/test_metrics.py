@@ -0,0 +1,93 @@
+"""
+Tests for metrics.py.
+"""
+import time
+
+from ckanext.massbankharvester import metrics
+from ckanext.massbankharvester.metrics import BUCKETS
+from ckanext.massbankharvester.metrics import Histogram
+from ckanext.massbankharvester.metrics import JobTimings
+from ckanext.massbankharvester.metrics import Stopwatch
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram()
+    for _ in range(98):
+        histogram.observe(0.004)
+    histogram.observe(0.3)
+    histogram.observe(120)
+
+    assert histogram.count == 100
+    assert histogram.counts[BUCKETS.index(0.005)] == 98
+    assert histogram.counts[-1] == 1
+    assert 0.0025 < histogram.quantile(0.5) <= 0.005
+    assert 0.25 < histogram.quantile(0.99) <= 0.5
+    assert histogram.quantile(1) == BUCKETS[-1]
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    first.observe(0.01)
+    second.observe(0.01)
+    second.observe(2)
+    first.merge(second)
+
+    assert first.count == 3
+    assert abs(first.sum - 2.02) < 1e-9
+
+
+def test_stopwatch_leaves_out_the_loop_body():
+    def slow_items():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    watch = Stopwatch()
+    items = []
+    for item in watch.iterate(slow_items()):
+        time.sleep(0.02)
+        items.append(item)
+
+    assert items == [0, 1, 2]
+    assert 0.03 <= watch.elapsed < 0.06
+    assert watch.reset() >= 0.03
+    assert watch.elapsed == 0
+
+
+def test_job_timings_flush_after_interval(monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        metrics, "add_job_timings", lambda job_id, source_id, histograms: written.append(histograms)
+    )
+    timings = JobTimings("job", "source", flush_interval=3600)
+    with timings.time("json_parse"):
+        pass
+    timings.observe("json_parse", 0.5)
+    assert written == []
+
+    timings.flush_interval = 0
+    timings.observe("molecule", 0.1)
+    assert len(written) == 1
+    assert written[0]["json_parse"].count == 2
+    assert written[0]["molecule"].count == 1
+
+    timings.flush()
+    assert len(written) == 1
+
+
+def test_prometheus_text(monkeypatch):
+    histogram = Histogram()
+    histogram.observe(0.004)
+    histogram.observe(0.2)
+    monkeypatch.setattr(
+        metrics, "read_job_timings", lambda **kw: [("source", "job", "json_parse", histogram)]
+    )
+    lines = metrics.prometheus_text().splitlines()
+    labels = 'source="source",job="job",step="json_parse"'
+
+    assert "# TYPE massbankharvester_step_seconds histogram" in lines
+    assert 'massbankharvester_step_seconds_bucket{%s,le="0.001"} 0' % labels in lines
+    assert 'massbankharvester_step_seconds_bucket{%s,le="0.005"} 1' % labels in lines
+    assert 'massbankharvester_step_seconds_bucket{%s,le="+Inf"} 2' % labels in lines
+    assert "massbankharvester_step_seconds_count{%s} 2" % labels in lines
@@ -0,0 +1,129 @@
+"""
+Tests for harvester/oai.py.
+"""
+import io
+
+import pytest
+from oaipmh.error import BadResumptionTokenError
+from oaipmh.error import NoRecordsMatchError
+
+from ckanext.massbankharvester.harvester.metadata import metadata_registry
+from ckanext.massbankharvester.harvester.oai import list_pages
+from ckanext.massbankharvester.harvester.oai import iter_page
+
+
+class FakeClient(object):
+    """Serves ListIdentifiers pages from a dict of token -> (items, next token)"""
+
+    def __init__(self, pages, expired=()):
+        self.pages = pages
+        self.expired = set(expired)
+        self.requests = []
+
+    def getNamespaces(self):
+        return {}
+
+    def makeRequestErrorHandling(self, **kw):
+        self.requests.append(kw)
+        token = kw.get("resumptionToken")
+        if token in self.expired:
+            self.expired.discard(token)
+            raise BadResumptionTokenError(token)
+        return token
+
+    def buildIdentifiers(self, namespaces, tree):
+        return self.pages[tree]
+
+
+PAGES = {
+    None: (["a", "b"], "t1"),
+    "t1": (["c"], "t2"),
+    "t2": (["d"], None),
+}
+
+
+def test_list_pages_walks_all_tokens():
+    client = FakeClient(PAGES)
+    pages = [
+        (list(page), page.token)
+        for page in list_pages(client, "ListIdentifiers", metadataPrefix="json_container", set=None)
+    ]
+
+    assert pages == [(["a", "b"], "t1"), (["c"], "t2"), (["d"], None)]
+    assert client.requests[0] == {"verb": "ListIdentifiers", "metadataPrefix": "json_container"}
+
+
+def test_list_pages_resumes_from_token():
+    client = FakeClient(PAGES)
+    pages = [
+        (list(page), page.token)
+        for page in list_pages(client, "ListIdentifiers", "t1", metadataPrefix="json_container")
+    ]
+
+    assert pages == [(["c"], "t2"), (["d"], None)]
+
+
+def test_list_pages_restarts_on_expired_token():
+    client = FakeClient(PAGES, expired=("t1",))
+    pages = [list(page) for page in list_pages(client, "ListIdentifiers", "t1", metadataPrefix="json_container")]
+
+    assert pages == [["a", "b"], ["c"], ["d"]]
+
+
+LIST_RECORDS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2023-01-01T00:00:00Z</responseDate>
+  <request verb="ListRecords">https://example.org/oai</request>
+  <ListRecords>
+    <record>
+      <header>
+        <identifier>MSBNK-1</identifier>
+        <datestamp>2023-01-01</datestamp>
+        <setSpec>massbank</setSpec>
+      </header>
+      <metadata>
+        <jc:json xmlns:jc="http://denbi.de/schemas/json-container"><![CDATA[{"name": "a"}]]></jc:json>
+      </metadata>
+    </record>
+    <record>
+      <header status="deleted">
+        <identifier>MSBNK-2</identifier>
+        <datestamp>2023-01-02</datestamp>
+      </header>
+    </record>
+    <resumptionToken>t1</resumptionToken>
+  </ListRecords>
+</OAI-PMH>
+"""
+
+
+def _read_page(source, *args):
+    items = iter_page(source, *args)
+    records = []
+    while True:
+        try:
+            records.append(next(items))
+        except StopIteration as stop:
+            return records, stop.value
+
+
+def test_iter_page_reads_records_and_token():
+    records, token = _read_page(
+        io.BytesIO(LIST_RECORDS), "ListRecords", "json_container", metadata_registry
+    )
+
+    assert token == "t1"
+    assert [header.identifier() for header, _, _ in records] == ["MSBNK-1", "MSBNK-2"]
+    assert records[0][0].setSpec() == ["massbank"]
+    assert records[0][1].getMap() == {"json_data": ['{"name": "a"}']}
+    assert records[1][0].isDeleted()
+    assert records[1][1] is None
+
+
+def test_iter_page_raises_oai_errors():
+    page = (
+        b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        b'<error code="noRecordsMatch">nothing</error></OAI-PMH>'
+    )
+    with pytest.raises(NoRecordsMatchError):
+        _read_page(io.BytesIO(page), "ListIdentifiers")
@@ -0,0 +1,156 @@
+"""
+Tests for harvester/partitions.py and oai.list_set_specs.
+"""
+import threading
+
+import pytest
+from oaipmh.error import NoSetHierarchyError
+
+from ckanext.massbankharvester.harvester.oai import Page
+from ckanext.massbankharvester.harvester.oai import list_set_specs
+from ckanext.massbankharvester.harvester.partitions import date_windows
+from ckanext.massbankharvester.harvester.partitions import list_partitions
+from ckanext.massbankharvester.harvester.partitions import plan_partitions
+
+
+def page(items, token=None):
+    def read():
+        yield from items
+        return token
+    return Page(read())
+
+
+def test_date_windows():
+    assert date_windows("2023-01-01T00:00:00Z", "2023-01-03T12:00:00Z", 1) == [
+        ("2023-01-01T00:00:00Z", "2023-01-01T23:59:59Z"),
+        ("2023-01-02T00:00:00Z", "2023-01-02T23:59:59Z"),
+        ("2023-01-03T00:00:00Z", "2023-01-03T12:00:00Z"),
+    ]
+    assert date_windows("2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z", 30) == [
+        ("2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z"),
+    ]
+
+
+def test_plan_partitions():
+    start, end = "2023-01-01T00:00:00Z", "2023-01-02T23:59:59Z"
+
+    assert plan_partitions([None], start, end) == [(None, start, end)]
+    assert plan_partitions(["a", "b"], start, end, 1) == [
+        ("a", start, "2023-01-01T23:59:59Z"),
+        ("a", "2023-01-02T00:00:00Z", end),
+        ("b", start, "2023-01-01T23:59:59Z"),
+        ("b", "2023-01-02T00:00:00Z", end),
+    ]
+
+
+def test_list_set_specs():
+    class Client(object):
+        def __init__(self, sets):
+            self.sets = sets
+
+        def listSets(self):
+            if self.sets is None:
+                raise NoSetHierarchyError()
+            return ((spec, spec, None) for spec in self.sets)
+
+    assert list_set_specs(Client(["a", "a:b", "a:b:c", "b:c", "c"])) == ["a", "b:c", "c"]
+    assert list_set_specs(Client(None)) == [None]
+    assert list_set_specs(Client([])) == [None]
+
+
+def test_list_partitions_keeps_the_page_order_of_each_partition():
+    slow = threading.Event()
+
+    def list_pages(partition):
+        if partition == "slow":
+            # held back until the other partition is done
+            slow.wait(5)
+        for i in range(3):
+            yield page(["%s-%s" % (partition, i)], i + 1 if i < 2 else None)
+        if partition == "fast":
+            slow.set()
+
+    events = list(list_partitions(["slow", "fast"], list_pages, 2))
+    items = [(partition, list(page)) for partition, page in events if page is not None]
+
+    assert [item for partition, item in items if partition == "slow"] == [
+        ["slow-0"], ["slow-1"], ["slow-2"]
+    ]
+    assert [partition for partition, _ in items][:3] == ["fast"] * 3
+    assert events[-1] == ("slow", None)
+
+
+def test_list_partitions_reports_failures():
+    def list_pages(partition):
+        yield page([partition])
+        if partition == "bad":
+            raise IOError("connection reset")
+
+    ends = dict(
+        (partition, page) for partition, page in list_partitions(["good", "bad"], list_pages, 2)
+        if not isinstance(page, Page)
+    )
+
+    assert ends["good"] is None
+    assert isinstance(ends["bad"], IOError)
+
+
+def test_list_partitions_stops_with_the_consumer():
+    started = []
+
+    def list_pages(partition):
+        started.append(partition)
+        while True:
+            yield page([partition], "token")
+
+    events = list_partitions(list(range(10)), list_pages, 2)
+    next(events)
+    events.close()
+
+    assert len(started) < 10
+    with pytest.raises(StopIteration):
+        next(events)
+
+
+def test_list_partitions_hands_items_over_while_the_page_is_read():
+    received = threading.Event()
+
+    def items():
+        yield "first"
+        # the thread only goes on once the consumer got the first item
+        if not received.wait(5):
+            raise AssertionError("first item not handed over")
+        yield "second"
+
+    def list_pages(partition):
+        yield Page(items())
+
+    events = list_partitions(["only"], list_pages, 1, chunk_size=1)
+    _, streamed = next(events)
+    items_read = []
+    for item in streamed:
+        items_read.append(item)
+        received.set()
+
+    assert items_read == ["first", "second"]
+    assert streamed.error is None
+    assert list(events) == [("only", None)]
+
+
+def test_list_partitions_cuts_pages_that_fail_while_read():
+    def items():
+        yield "first"
+        raise IOError("connection reset")
+
+    def list_pages(partition):
+        yield Page(items())
+
+    events = list_partitions(["bad"], list_pages, 1)
+    _, cut = next(events)
+
+    assert list(cut) == ["first"]
+    assert isinstance(cut.error, IOError)
+    assert cut.token is None
+    _, end = next(events)
+    assert end is cut.error
+
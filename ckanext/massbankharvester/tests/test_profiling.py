@@ -0,0 +1,57 @@
+"""
+Tests for profiling.py.
+"""
+import os
+import pstats
+
+from ckanext.massbankharvester.profiling import StageProfiler
+from ckanext.massbankharvester.profiling import get_profile_every
+
+
+def work():
+    return sum(i * i for i in range(1000))
+
+
+def test_profiles_every_nth_call(tmp_path):
+    profiler = StageProfiler(str(tmp_path))
+    for i in range(7):
+        with profiler.profile("import_stage", "job-1", "oai:massbank.eu:MSBNK-%s" % i, 3):
+            work()
+
+    names = sorted(os.listdir(str(tmp_path / "job-1")))
+    assert len(names) == 2
+    assert names[0].startswith("import_stage-oai_massbank.eu_MSBNK-2-")
+    assert names[1].startswith("import_stage-oai_massbank.eu_MSBNK-5-")
+
+
+def test_profiling_off(tmp_path):
+    profiler = StageProfiler(str(tmp_path))
+    with profiler.profile("fetch_stage", "job-1", "guid", 0):
+        work()
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_merge_per_stage(tmp_path):
+    profiler = StageProfiler(str(tmp_path))
+    for stage in ("fetch_stage", "import_stage", "import_stage"):
+        with profiler.profile(stage, "job-1", "guid", 1):
+            work()
+
+    merged = profiler.merge("job-1")
+
+    assert [os.path.basename(path) for path in merged] == [
+        "aggregate-fetch_stage.prof", "aggregate-import_stage.prof"
+    ]
+    stats = pstats.Stats(merged[1])
+    assert any(func[2] == "work" and stat[0] == 2 for func, stat in stats.stats.items())
+    assert os.path.exists(str(tmp_path / "job-1" / "aggregate-import_stage.txt"))
+    # merging again does not count the aggregates
+    assert len(profiler.merge("job-1")) == 2
+    assert profiler.merge("unknown-job") == []
+
+
+def test_profile_every_from_source_config():
+    assert get_profile_every('{"profile_every": 100}') == 100
+    assert get_profile_every('{"list_records": true}') == 0
+    assert get_profile_every(None) == 0
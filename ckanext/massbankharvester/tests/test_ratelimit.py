@@ -0,0 +1,55 @@
+"""
+Tests for harvester/ratelimit.py.
+"""
+import time
+
+from ckanext.massbankharvester.harvester.ratelimit import HostLimiter
+from ckanext.massbankharvester.harvester.ratelimit import backoff_delay
+from ckanext.massbankharvester.harvester.ratelimit import parse_retry_after
+
+
+def test_limiter_halves_concurrency_when_throttled():
+    limiter = HostLimiter(max_concurrency=8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+
+    assert limiter.concurrency == 4
+
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+
+    assert 4 < limiter.concurrency <= 8
+
+
+def test_limiter_paces_requests():
+    limiter = HostLimiter(rate=50)
+    start = time.monotonic()
+    for _ in range(60):
+        limiter.acquire()
+        limiter.release()
+
+    # a burst of 50 tokens, then 10 at 50 per second
+    assert time.monotonic() - start >= 0.15
+
+
+def test_limiter_pauses_on_retry_after():
+    limiter = HostLimiter()
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - start >= 0.15
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_backoff_delay_is_bounded():
+    assert 0.5 <= backoff_delay(0) <= 1
+    assert 30 <= backoff_delay(10, maximum=60) <= 60
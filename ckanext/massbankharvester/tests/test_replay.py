@@ -0,0 +1,40 @@
+"""
+Tests for harvester/replay.py.
+"""
+import io
+import os
+
+import pytest
+
+from ckanext.massbankharvester.harvester.replay import CacheMiss
+from ckanext.massbankharvester.harvester.replay import ResponseCache
+
+BASE_URL = "https://example.org/oai"
+REQUEST = {"verb": "ListIdentifiers", "metadataPrefix": "json_container"}
+
+
+def test_recorded_response_is_replayed(tmp_path):
+    ResponseCache(str(tmp_path), "record").write(BASE_URL, REQUEST, b"<OAI-PMH/>")
+    cache = ResponseCache(str(tmp_path), "replay")
+
+    assert cache.read(BASE_URL, dict(reversed(list(REQUEST.items())))) == b"<OAI-PMH/>"
+    with pytest.raises(CacheMiss):
+        cache.read(BASE_URL, dict(REQUEST, set="massbank"))
+
+
+def test_recorder_keeps_only_complete_responses(tmp_path):
+    cache = ResponseCache(str(tmp_path), "record")
+
+    recorder = cache.recorder(BASE_URL, REQUEST, io.BytesIO(b"<OAI-PMH/>"))
+    recorder.read(4)
+    recorder.close()
+    assert not os.path.exists(cache.path(BASE_URL, REQUEST))
+
+    recorder = cache.recorder(BASE_URL, REQUEST, io.BytesIO(b"<OAI-PMH/>"))
+    while recorder.read(4):
+        pass
+    recorder.close()
+    assert cache.read(BASE_URL, REQUEST) == b"<OAI-PMH/>"
+    assert os.listdir(os.path.dirname(cache.path(BASE_URL, REQUEST))) == [
+        os.path.basename(cache.path(BASE_URL, REQUEST))
+    ]
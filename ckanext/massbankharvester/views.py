@@ -0,0 +1,62 @@
+import re
+
+from flask import Blueprint
+from flask import Response
+from flask import send_file
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.massbankharvester import images
+from ckanext.massbankharvester import metrics
+
+INCHI_KEY_RE = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+
+molecule = Blueprint("massbankharvester", __name__)
+harvest_metrics = Blueprint("massbankharvester_metrics", __name__)
+
+
+def molecule_image(inchi_key, fmt):
+    """
+    Structure image of a harvested molecule, drawn on the first request.
+
+    The ``size`` query parameter selects one of images.IMAGE_SIZES.
+    """
+    size = toolkit.request.args.get("size", images.DEFAULT_SIZE, type=int)
+    if not INCHI_KEY_RE.match(inchi_key) or fmt not in images.IMAGE_FORMATS \
+            or size not in images.IMAGE_SIZES:
+        return toolkit.abort(404, toolkit._("Molecule not found"))
+    filepath = images.get_or_render_image(inchi_key, fmt, size)
+    if filepath is None:
+        return toolkit.abort(404, toolkit._("Molecule not found"))
+    response = send_file(filepath, mimetype=images.IMAGE_FORMATS[fmt])
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+
+molecule.add_url_rule("/molecule/<inchi_key>.<fmt>", view_func=molecule_image)
+
+
+def job_metrics():
+    """
+    Step timings of the most recent harvest jobs in the Prometheus text
+    format, for sysadmins unless ``ckanext.massbankharvester.metrics_public``
+    is set
+    """
+    if not toolkit.asbool(toolkit.config.get("ckanext.massbankharvester.metrics_public", False)):
+        try:
+            toolkit.check_access("sysadmin", {"user": toolkit.g.user})
+        except toolkit.NotAuthorized:
+            return toolkit.abort(403, toolkit._("Not authorized to see the harvest metrics"))
+    limit = int(toolkit.config.get("ckanext.massbankharvester.metrics_jobs", 10))
+    return Response(
+        metrics.prometheus_text(limit),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+harvest_metrics.add_url_rule("/massbankharvester/metrics", view_func=job_metrics)
+
+
+def get_blueprints():
+    return [molecule, harvest_metrics]
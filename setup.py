@@ -54,7 +54,7 @@ setup(
 
     # You can just specify the packages manually here if your project is
     # simple. Or you can use find_packages().
-    packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
+    packages=find_packages(exclude=['contrib', 'docs', 'tests*', 'benchmarks*']),
         namespace_packages=['ckanext'],
 
     install_requires=[
@@ -85,6 +85,7 @@ setup(
     entry_points='''
         [ckan.plugins]
         massbankharvester=ckanext.massbankharvester.harvester.nmrXivharvester:MassbankHarvester
+        massbankharvester_plugin=ckanext.massbankharvester.plugin:MassbankharvesterPlugin
 
         [babel.extractors]
         ckan = ckan.lib.extract:extract_ckan